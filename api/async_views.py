@@ -0,0 +1,202 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import CachedTokenAuthentication
+from .cache import aget_featured_books
+from .conditional import ConditionalGetMixin
+from .metrics import timed
+from .models import Book, BookReview
+from .pagination import BookCursorPagination, BookReviewCursorPagination
+from .renderers import ORJSONRenderer
+from .serializers import (
+    BookDetailSerializer,
+    BookReviewSearchSerializer,
+    BookReviewSerializer,
+    BookRowSerializer,
+    BookSearchParamsSerializer,
+    BookSerializer,
+)
+from .views import book_validator_values, only_picked_fields
+
+
+class AsyncAPIView(ConditionalGetMixin, View):
+    """
+    Base for async-native, read-only versions of the busiest endpoints,
+    served under /api/async/. They answer with the same JSON as the DRF views
+    in api/views.py, but do their cache and database reads with the async
+    APIs, so under ASGI (uvicorn library.asgi:application) a request waiting
+    on the database doesn't hold a worker thread.
+
+    DRF views can't be async, so this does the parts of APIView these
+    endpoints need: token authentication, error responses and JSON rendering.
+    """
+
+    http_method_names = ["get", "head", "options"]
+    authenticator = CachedTokenAuthentication()
+    renderer = JSONRenderer()
+    # like IsAuthenticated; False is like IsAuthenticatedOrReadOnly for GETs
+    authentication_required = True
+    pagination_class = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        # DRF's Request gives the serializers and paginators query_params
+        self.request = Request(request)
+        self.paginator = self.pagination_class() if self.pagination_class else None
+        try:
+            auth = await self.authenticator.aauthenticate(request)
+            if auth is not None:
+                self.request.user, self.request.auth = auth
+            elif self.authentication_required:
+                raise exceptions.NotAuthenticated()
+            return await super().dispatch(self.request, *args, **kwargs)
+        except Http404:
+            return self.error_response(exceptions.NotFound())
+        except exceptions.APIException as error:
+            return self.error_response(error)
+
+    def error_response(self, error):
+        if isinstance(error.detail, (list, dict)):
+            data = error.detail
+        else:
+            data = {"detail": error.detail}
+        response = self.render(data, status=error.status_code)
+        if response.status_code == 401:
+            response["WWW-Authenticate"] = self.authenticator.authenticate_header(
+                self.request
+            )
+        return response
+
+    def render(self, data, status=200):
+        render = self.renderer.render
+        metrics = getattr(self.request, "metrics", None)
+        if metrics is not None:
+            render = timed(render, metrics)
+        return HttpResponse(
+            render(data), status=status, content_type="application/json"
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = self.serializer_class(
+            *args, context={"request": self.request}, **kwargs
+        )
+        metrics = getattr(self.request, "metrics", None)
+        if metrics is not None:
+            serializer.to_representation = timed(serializer.to_representation, metrics)
+        return serializer
+
+    async def paginated_response(self, queryset):
+        page = await self.paginator.apaginate_queryset(queryset, self.request, self)
+        data = self.get_serializer(page, many=True).data
+        return self.render(self.paginator.get_paginated_response(data).data)
+
+
+class AsyncBookListView(AsyncAPIView):
+    # GET /api/async/books, like GET /api/books
+    serializer_class = BookSerializer
+    pagination_class = BookCursorPagination
+
+    async def get(self, request):
+        queryset = Book.objects.order_by("title")
+        rows = await self.aget_validator_rows(queryset)
+        if settings.FAST_BOOK_LIST:
+            # plain rows rendered with orjson, like BookViewSet.list
+            self.serializer_class = BookRowSerializer
+            self.renderer = ORJSONRenderer()
+            queryset = self.get_serializer().rows(queryset, *self.paginator.ordering)
+        return await self.aconditional_response(
+            request, rows, lambda: self.paginated_response(queryset)
+        )
+
+
+class AsyncBookDetailView(AsyncAPIView):
+    # GET /api/async/books/{id}, like GET /api/books/{id}
+    serializer_class = BookDetailSerializer
+
+    async def get(self, request, pk):
+        rows = [row async for row in book_validator_values(Book.objects.filter(pk=pk))]
+
+        async def respond():
+            try:
+                book = await Book.objects.with_review_links().aget(pk=pk)
+            except Book.DoesNotExist:
+                raise Http404
+            return self.render(self.get_serializer(book).data)
+
+        return await self.aconditional_response(request, rows, respond)
+
+
+class AsyncFeaturedBooksView(AsyncAPIView):
+    # GET /api/async/books/featured, like GET /api/books/featured
+    serializer_class = BookDetailSerializer
+
+    async def get(self, request):
+        featured_books = Book.objects.with_review_links().filter(featured=True)
+
+        async def get_rows():
+            validators = book_validator_values(
+                Book.objects.filter(featured=True).order_by("pk")
+            )
+            return [row async for row in validators]
+
+        async def serialize():
+            books = [book async for book in featured_books.order_by("title")]
+            return self.get_serializer(books, many=True).data
+
+        # shares the cached rows and payload with BookViewSet.featured
+        rows, get_data = await aget_featured_books(request, get_rows, serialize)
+
+        async def respond():
+            return self.render(await get_data())
+
+        return await self.aconditional_response(request, rows, respond)
+
+
+class AsyncBookSearchView(AsyncAPIView):
+    # GET /api/async/books/search/, like GET /api/books/search/
+    serializer_class = BookSerializer
+    authentication_required = False
+
+    async def get(self, request):
+        params = BookSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        search_terms = dict(params.validated_data)
+        limit = search_terms.pop("limit")
+
+        queryset = only_picked_fields(
+            Book.objects.search(**search_terms), self.get_serializer()
+        )
+        results = [book async for book in queryset[:limit]]
+        return self.render(self.get_serializer(results, many=True).data)
+
+
+class AsyncBookReviewListView(AsyncAPIView):
+    # GET /api/async/books/{book_pk}/reviews, like GET /api/books/{book_pk}/reviews
+    serializer_class = BookReviewSerializer
+    pagination_class = BookReviewCursorPagination
+
+    async def get(self, request, book_pk):
+        queryset = BookReview.objects.filter(book_id=book_pk).select_related(
+            "book", "reviewed_by"
+        )
+        search_term = request.query_params.get("search")
+        if search_term is None:
+            rows = await self.aget_validator_rows(queryset)
+            return await self.aconditional_response(
+                request, rows, lambda: self.paginated_response(queryset)
+            )
+
+        # like BookReviewListCreateView, search results are the best matches
+        # up to the page size, unpaginated
+        self.serializer_class = BookReviewSearchSerializer
+        queryset = queryset.search(search_term)[: self.paginator.get_page_size(request)]
+        reviews = [review async for review in queryset]
+        rows = [(review.pk, review.updated_at) for review in reviews]
+
+        async def respond():
+            return self.render(self.get_serializer(reviews, many=True).data)
+
+        return await self.aconditional_response(request, rows, respond)
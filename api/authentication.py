@@ -0,0 +1,89 @@
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+# hits and misses of the token cache in this process
+token_cache_stats = Counter(hits=0, misses=0)
+
+
+def token_cache_key(key):
+    # hash the token so the raw credential never ends up in the cache backend
+    return "auth_token:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_cached_token(key):
+    cache.delete(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps the token and its user in the cache for
+    TOKEN_AUTH_CACHE_TIMEOUT seconds, so most requests skip the
+    token + user query. Cached entries are dropped by the signal handlers in
+    api/signals.py when a token is deleted (e.g. on logout) or its user
+    changes (e.g. is deactivated).
+
+    Without a shared cache (settings.SHARED_CACHE) those invalidations would
+    only reach the worker that handled them, so every lookup goes to the
+    database, like plain TokenAuthentication.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.SHARED_CACHE:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            token_cache_stats["misses"] += 1
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.TOKEN_AUTH_CACHE_TIMEOUT)
+        else:
+            token_cache_stats["hits"] += 1
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return (token.user, token)
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for the async views in api/async_views.py, which can't
+        make blocking cache or database calls.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        if not settings.SHARED_CACHE:
+            token = await self.aget_token(key)
+            return (token.user, token)
+
+        cache_key = token_cache_key(key)
+        token = await cache.aget(cache_key)
+        if token is None:
+            token_cache_stats["misses"] += 1
+            token = await self.aget_token(key)
+            await cache.aset(cache_key, token, settings.TOKEN_AUTH_CACHE_TIMEOUT)
+        else:
+            token_cache_stats["hits"] += 1
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return (token.user, token)
+
+    async def aget_token(self, key):
+        # the database lookup of authenticate_credentials(), async
+        try:
+            token = await self.get_model().objects.select_related("user").aget(key=key)
+        except self.get_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return token
@@ -0,0 +1,82 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Book
+
+FEATURED_BOOKS_VERSION_KEY = "featured_books:version"
+
+
+def featured_books_version():
+    # seeded with the current time so that if the version key is ever evicted,
+    # the new version can't collide with one that already has a payload cached.
+    # It never expires: only invalidate_featured_books() should change it.
+    return cache.get_or_set(FEATURED_BOOKS_VERSION_KEY, time.time_ns, timeout=None)
+
+
+def featured_books_cache_key(request):
+    # the payload has absolute review URLs in it, so it depends on the host
+    return f"featured_books:{featured_books_version()}:{request.get_host()}"
+
+
+def get_featured_books(request, get_rows, serialize):
+    """
+    Return the featured books' validator rows and a function that returns
+    their payload. `get_rows()` builds the rows and `serialize()` the payload.
+    Both are cached together, so the ETag always matches the body served.
+    Without a shared cache another worker couldn't see an invalidation, so
+    both are built from the database every time.
+    """
+    if not settings.SHARED_CACHE:
+        return get_rows(), serialize
+    key = featured_books_cache_key(request)
+    entry = cache.get(key)
+    if entry is None:
+        entry = (get_rows(), serialize())
+        cache.set(key, entry, settings.FEATURED_BOOKS_CACHE_TIMEOUT)
+    rows, data = entry
+
+    def cached():
+        return data
+
+    return rows, cached
+
+
+async def aget_featured_books(request, get_rows, serialize):
+    """
+    get_featured_books() for async views; `get_rows` and `serialize` are
+    coroutine functions, and so is the function returned.
+    """
+    if not settings.SHARED_CACHE:
+        return await get_rows(), serialize
+    version = await cache.aget_or_set(
+        FEATURED_BOOKS_VERSION_KEY, time.time_ns, timeout=None
+    )
+    key = f"featured_books:{version}:{request.get_host()}"
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = (await get_rows(), await serialize())
+        await cache.aset(key, entry, settings.FEATURED_BOOKS_CACHE_TIMEOUT)
+    rows, data = entry
+
+    async def cached():
+        return data
+
+    return rows, cached
+
+
+def invalidate_featured_books():
+    """
+    Bump the version so every cached featured books payload is ignored from
+    now on; the stale copies expire on their own.
+    """
+    try:
+        cache.incr(FEATURED_BOOKS_VERSION_KEY)
+    except ValueError:
+        cache.set(FEATURED_BOOKS_VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate_if_featured(book_pks):
+    if Book.objects.filter(pk__in=book_pks, featured=True).exists():
+        invalidate_featured_books()
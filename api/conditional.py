@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Lets a view answer GET requests with 304 Not Modified when the client's
+    cached copy is still current. The validators are computed from the
+    primary keys and updated_at timestamps of the objects in the response,
+    which is a cheap query, so an unchanged response is never serialized.
+    """
+
+    def get_validator_rows(self, queryset):
+        """
+        Return (pk, updated_at) pairs for the objects that this request's
+        response would contain: the current page for paginated lists, or the
+        whole queryset otherwise.
+        """
+        # the related objects the response joins or prefetches aren't needed
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if self.paginator is None:
+            return list(queryset.values_list("pk", "updated_at"))
+        fields = self.get_validator_fields()
+        page = self.paginate_queryset(queryset.only(*fields))
+        if page is None:
+            page = queryset.only(*fields)
+        return [(obj.pk, obj.updated_at) for obj in page]
+
+    async def aget_validator_rows(self, queryset):
+        # get_validator_rows() for async views, see api/async_views.py
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if self.paginator is None:
+            return [row async for row in queryset.values_list("pk", "updated_at")]
+        queryset = queryset.only(*self.get_validator_fields())
+        page = await self.paginator.apaginate_queryset(queryset, self.request, self)
+        if page is None:
+            page = [obj async for obj in queryset]
+        return [(obj.pk, obj.updated_at) for obj in page]
+
+    def get_validator_fields(self):
+        # the paginator needs the fields it orders by to build cursors
+        ordering = getattr(self.paginator, "ordering", ())
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        return {"pk", "updated_at", *(field.lstrip("-") for field in ordering)}
+
+    def conditional_response(self, request, rows, respond):
+        """
+        Return 304 Not Modified if the ETag / Last-Modified built from `rows`
+        match the request's If-None-Match / If-Modified-Since headers,
+        otherwise call `respond()` and add the validators to its response.
+        """
+        etag, last_modified = self.validators(request, rows)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = respond()
+        return self.add_validators(response, etag, last_modified)
+
+    async def aconditional_response(self, request, rows, respond):
+        # conditional_response() for async views; `respond` is a coroutine function
+        etag, last_modified = self.validators(request, rows)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = await respond()
+        return self.add_validators(response, etag, last_modified)
+
+    def validators(self, request, rows):
+        digest = hashlib.md5(
+            f"{request.get_full_path()}|{rows}".encode(), usedforsecurity=False
+        )
+        etag = quote_etag(digest.hexdigest())
+        timestamps = [
+            value for row in rows for value in row if isinstance(value, datetime)
+        ]
+        last_modified = int(max(timestamps).timestamp()) if timestamps else None
+        return etag, last_modified
+
+    def add_validators(self, response, etag, last_modified):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
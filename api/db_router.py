@@ -0,0 +1,33 @@
+from contextvars import ContextVar
+
+# The replica a request's reads go to, picked once per request by
+# ReplicaRoutingMiddleware so they all see the same replication lag.
+# None for everything else (writes, management commands, background
+# workers), which reads from the primary.
+read_replica = ContextVar("read_replica", default=None)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the read_replica of the current request, if any, and
+    everything else to the primary ("default").
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = read_replica.get()
+        # a token is read right after logging in creates it, before the
+        # replicas may have caught up
+        if replica is None or model._meta.label == "authtoken.Token":
+            return "default"
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema through replication
+        return db == "default"
@@ -0,0 +1,41 @@
+import csv
+import json
+
+# the fields written for each book in a catalog export
+BOOK_EXPORT_FIELDS = (
+    "pk",
+    "title",
+    "author",
+    "publication_year",
+    "featured",
+    "favorite_count",
+)
+
+
+class Echo:
+    """
+    A file-like object that hands back whatever is written to it,
+    so csv.writer can produce one line at a time for a streaming response.
+    https://docs.djangoproject.com/en/4.2/howto/outputting-csv/#streaming-large-csv-files
+    """
+
+    def write(self, value):
+        return value
+
+
+def book_rows(queryset, chunk_size):
+    # .iterator() uses a server-side cursor on Postgres, so only chunk_size
+    # rows are held in memory at once and no model instances are built
+    return queryset.values_list(*BOOK_EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def stream_books_ndjson(queryset, chunk_size=2000):
+    for row in book_rows(queryset, chunk_size):
+        yield json.dumps(dict(zip(BOOK_EXPORT_FIELDS, row))) + "\n"
+
+
+def stream_books_csv(queryset, chunk_size=2000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(BOOK_EXPORT_FIELDS)
+    for row in book_rows(queryset, chunk_size):
+        yield writer.writerow(row)
@@ -0,0 +1,142 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from .cache import invalidate_if_featured
+
+logger = logging.getLogger(__name__)
+
+# name -> maximum (width, height); images are scaled down to fit, never up
+RENDITION_SIZES = {
+    "thumbnail": (150, 150),
+    "medium": (600, 600),
+}
+
+# image field -> field holding the names of its renditions, per model
+RENDITION_FIELDS = {
+    "api.Book": ("title_page", "title_page_renditions"),
+    "api.User": ("avatar", "avatar_renditions"),
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.IMAGE_WORKERS, 1), thread_name_prefix="renditions"
+)
+
+
+def rendition_name(name, size):
+    extension = "webp" if settings.IMAGE_RENDITION_FORMAT == "WEBP" else "jpg"
+    stem, _ = posixpath.splitext(name)
+    return f"renditions/{stem}_{size}.{extension}"
+
+
+def render(image, max_size):
+    """
+    Return the bytes of `image` scaled down to fit in `max_size`.
+    """
+    image = image.copy()
+    image.thumbnail(max_size)
+    if settings.IMAGE_RENDITION_FORMAT == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, settings.IMAGE_RENDITION_FORMAT, quality=80)
+    return buffer.getvalue()
+
+
+def generate_renditions(model_label, pk):
+    """
+    Build every rendition of an object's image and record their names on it.
+    """
+    try:
+        model = apps.get_model(model_label)
+        image_field, renditions_field = RENDITION_FIELDS[model_label]
+        name = model.objects.filter(pk=pk).values_list(image_field, flat=True).first()
+        if not name:
+            return
+
+        # renditions live next to the image, in its field's storage
+        storage = model._meta.get_field(image_field).storage
+        with storage.open(name) as file:
+            # phone photos are often stored sideways with an EXIF rotation
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+
+        renditions = {"source": name}
+        for size, max_size in RENDITION_SIZES.items():
+            renditions[size] = storage.save(
+                rendition_name(name, size), ContentFile(render(image, max_size))
+            )
+
+        # only record the renditions if the image hasn't been replaced meanwhile;
+        # update() skips post_save, so this doesn't schedule the work again
+        changes = {renditions_field: renditions}
+        if any(field.name == "updated_at" for field in model._meta.fields):
+            changes["updated_at"] = Now()
+        model.objects.filter(pk=pk, **{image_field: name}).update(**changes)
+
+        if model_label == "api.Book":
+            invalidate_if_featured([pk])
+    except Exception:
+        logger.exception("Could not build renditions for %s %s", model_label, pk)
+
+
+def generate_renditions_in_worker(model_label, pk):
+    try:
+        generate_renditions(model_label, pk)
+    finally:
+        # each worker thread has its own database connection
+        connection.close()
+
+
+def schedule_renditions(instance):
+    """
+    Queue the renditions of an object's image to be built in the background
+    once the current transaction commits, if its image changed since they
+    were last built. Jobs still queued when the process stops are lost; see
+    stale_renditions.
+    """
+    model_label = instance._meta.label
+    image_field, renditions_field = RENDITION_FIELDS[model_label]
+    name = getattr(instance, image_field).name
+    if not name or getattr(instance, renditions_field).get("source") == name:
+        return
+
+    if settings.IMAGE_WORKERS:
+        job = partial(
+            executor.submit, generate_renditions_in_worker, model_label, instance.pk
+        )
+    else:
+        job = partial(generate_renditions, model_label, instance.pk)
+    transaction.on_commit(job)
+
+
+def stale_renditions(model_label):
+    """
+    The pks of objects whose image has no renditions built for it, e.g.
+    because the process that queued them stopped first. The queue only
+    lives in memory, so the rebuild_renditions command catches these up.
+    """
+    model = apps.get_model(model_label)
+    image_field, renditions_field = RENDITION_FIELDS[model_label]
+    rows = (
+        model.objects.exclude(**{image_field: ""})
+        .values_list("pk", image_field, renditions_field)
+        .iterator()
+    )
+    return [pk for pk, name, renditions in rows if renditions.get("source") != name]
+
+
+def rendition_urls(storage, renditions):
+    return {
+        size: storage.url(renditions[size])
+        for size in RENDITION_SIZES
+        if size in renditions
+    }
@@ -0,0 +1,455 @@
+import json
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from functools import partial
+from itertools import count
+from pathlib import Path
+
+import boto3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.management.commands.seed_data import seed_volume
+from api.models import Book, BookRecord, BookReview, User
+from api.nplusone import QueryShapeRecorder, report
+from api.testing import BUCKET, S3_STORAGES, image_bytes
+from api.uploads import presign_upload
+
+# query counts at the largest default volume, recorded on PostgreSQL with
+# moto installed: the search routes need PostgreSQL, and counts can differ
+# between databases
+BASELINE_PATH = Path(__file__).resolve().parents[2] / "benchmarks" / "baseline.json"
+
+# sent with a body unless an endpoint gives its own request options
+JSON = {"format": "json"}
+# a raw image body, like StreamingImageUploadParser takes
+IMAGE = {
+    "content_type": "image/png",
+    "HTTP_CONTENT_DISPOSITION": "attachment; filename=page.png",
+}
+
+serial = count()
+
+
+def image_upload():
+    return SimpleUploadedFile("page.png", image_bytes(), "image/png")
+
+
+def new_book(objects):
+    return {
+        "title": f"Benchmark book {next(serial)}",
+        "author": "Benchmark",
+        "title_page": image_upload(),
+    }
+
+
+def new_review(objects):
+    BookReview.objects.filter(
+        book_id=objects["other"], reviewed_by=objects["reader"]
+    ).delete()
+    return {"body": "A new benchmark review."}
+
+
+def new_book_record(objects):
+    BookRecord.objects.filter(
+        book_id=objects["other"], reader=objects["reader"]
+    ).delete()
+    return {"reading_state": "rg"}
+
+
+def favorite_again(objects):
+    objects["reader"].favorite_books.add(objects["other"])
+
+
+def direct_upload(instance, field_name):
+    # what a client does before attaching: presign, then POST the image to S3;
+    # requests comes with moto, which these endpoints need anyway
+    import requests
+
+    post = presign_upload(instance, field_name, "page.png", "image/png")
+    requests.post(post["url"], data=post["fields"], files={"file": image_bytes()})
+    return {"upload_token": post["upload_token"]}
+
+
+# (name, method, url[, body[, options]]) for every API route in
+# library/urls.py. {book} and {review} are filled in with objects belonging
+# to the benchmark user, {other} with a book it hasn't touched yet. A body is
+# a function of the same objects, called before each request, outside the
+# timing and query count, so it can also undo what the previous request
+# changed. Options are passed to the test client, JSON by default. The async
+# views (api/async_views.py) follow their sync versions, so both find the
+# caches in the same state.
+ENDPOINTS = [
+    ("books-list", "get", "/api/books"),
+    ("async_books", "get", "/api/async/books"),
+    ("books-create", "post", "/api/books", new_book, {"format": "multipart"}),
+    ("books-detail", "get", "/api/books/{book}"),
+    ("async_book_detail", "get", "/api/async/books/{book}"),
+    (
+        "books-title_page",
+        "put",
+        "/api/books/{book}/title_page",
+        lambda objects: image_bytes(),
+        IMAGE,
+    ),
+    ("books-featured", "get", "/api/books/featured"),
+    ("async_featured_books", "get", "/api/async/books/featured"),
+    ("books-favorites", "get", "/api/books/favorites"),
+    ("books-export", "get", "/api/books/export"),
+    ("book_records-list", "get", "/api/books/{book}/book_records"),
+    (
+        "book_records-create",
+        "post",
+        "/api/books/{other}/book_records",
+        new_book_record,
+    ),
+    ("book_reviews", "get", "/api/books/{book}/reviews"),
+    ("async_book_reviews", "get", "/api/async/books/{book}/reviews"),
+    ("book_reviews-search", "get", "/api/books/{book}/reviews?search=review"),
+    (
+        "async_book_reviews-search",
+        "get",
+        "/api/async/books/{book}/reviews?search=review",
+    ),
+    ("book_reviews-create", "post", "/api/books/{other}/reviews", new_review),
+    ("book_review_detail", "get", "/api/reviews/{review}"),
+    ("favorite_books", "post", "/api/books/{book}/favorites"),
+    ("favorite_books-delete", "delete", "/api/books/{other}/favorites", favorite_again),
+    ("book_search", "get", "/api/books/search/?title=seed&publication_year_min=1600"),
+    (
+        "async_book_search",
+        "get",
+        "/api/async/books/search/?title=seed&publication_year_min=1600",
+    ),
+    ("shelves", "get", "/api/me/shelves"),
+    (
+        "batch_favorites",
+        "post",
+        "/api/me/favorites",
+        lambda objects: {"add": objects["favorites"]},
+    ),
+    (
+        "batch_book_records",
+        "post",
+        "/api/me/book_records",
+        lambda objects: [
+            {"book": pk, "reading_state": "rd"} for pk in objects["favorites"]
+        ],
+    ),
+    ("metrics", "get", "/api/metrics"),
+    ("user-me", "get", "/auth/users/me/"),
+    (
+        "user_avatar",
+        # a PUT would need the username too
+        "patch",
+        "/auth/users/me/avatar",
+        lambda objects: image_bytes(),
+        IMAGE,
+    ),
+]
+
+# the direct upload routes only work with S3 storage, so they are measured
+# against a moto S3 mock when moto is installed (see DirectUploadTests)
+S3_ENDPOINTS = [
+    (
+        "books-title_page-presign",
+        "post",
+        "/api/books/{book}/title_page/presign",
+        lambda objects: {"filename": "page.png", "content_type": "image/png"},
+    ),
+    (
+        "books-title_page-attach",
+        "post",
+        "/api/books/{book}/title_page/attach",
+        lambda objects: direct_upload(
+            Book.objects.get(pk=objects["book"]), "title_page"
+        ),
+    ),
+    (
+        "user_avatar_presign",
+        "post",
+        "/auth/users/me/avatar/presign",
+        lambda objects: {"filename": "avatar.png", "content_type": "image/png"},
+    ),
+    (
+        "user_avatar_attach",
+        "post",
+        "/auth/users/me/avatar/attach",
+        lambda objects: direct_upload(objects["reader"], "avatar"),
+    ),
+]
+
+
+# Django 5.2+ logs these too; they aren't counted, so counts stay comparable
+TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK")
+
+
+def counted_queries(queries):
+    return [
+        query for query in queries if query["sql"].upper() not in TRANSACTION_STATEMENTS
+    ]
+
+
+def response_body(response):
+    # streaming responses only run their queries as the body is consumed
+    if response.streaming:
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+def percentile(timings, percent):
+    return statistics.quantiles(timings, n=100, method="inclusive")[percent - 1]
+
+
+# To run this management command (on PostgreSQL, with the dev packages):
+# python manage.py benchmark
+# It runs against a throwaway test database, never the configured one.
+class Command(BaseCommand):
+    help = "Report latency, query count and response size for every API endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--volumes",
+            default="100,1000",
+            help="Comma-separated numbers of books to benchmark with, smallest first.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="Timed requests per endpoint at each volume.",
+        )
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help=f"Write the measured query counts to {BASELINE_PATH.name}.",
+        )
+
+    def handle(self, *args, **options):
+        volumes = sorted(int(volume) for volume in options["volumes"].split(","))
+        direct_uploads = True
+
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with ExitStack() as stack:
+                # only the primary is swapped for a test database, so keep the
+                # reads off any configured replicas; everything runs in this one
+                # process, so the local cache counts as shared. Renditions are
+                # built in the request, so their queries are counted, and
+                # uploads go to a throwaway MEDIA_ROOT.
+                stack.enter_context(
+                    override_settings(
+                        DATABASE_REPLICAS=[],
+                        SHARED_CACHE=True,
+                        IMAGE_WORKERS=0,
+                        MEDIA_ROOT=stack.enter_context(tempfile.TemporaryDirectory()),
+                    )
+                )
+                try:
+                    from moto import mock_aws
+                except ImportError:
+                    self.stderr.write(
+                        "moto isn't installed, skipping the direct upload endpoints."
+                    )
+                    direct_uploads = False
+                else:
+                    stack.enter_context(mock_aws())
+                    boto3.client("s3", region_name="us-east-1").create_bucket(
+                        Bucket=BUCKET
+                    )
+                results = self.run_benchmarks(
+                    volumes, options["iterations"], direct_uploads
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results, volumes)
+
+        query_counts = {
+            name: counts[volumes[-1]]["queries"] for name, counts in results.items()
+        }
+        if options["update_baseline"]:
+            BASELINE_PATH.parent.mkdir(exist_ok=True)
+            BASELINE_PATH.write_text(json.dumps(query_counts, indent=2) + "\n")
+            self.stdout.write(
+                self.style.SUCCESS(f"Baseline written to {BASELINE_PATH}")
+            )
+            return
+
+        failures = self.check_regressions(results, volumes)
+        if failures:
+            raise CommandError("\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("No query count regressions."))
+
+    def run_benchmarks(self, volumes, iterations, direct_uploads):
+        # staff, so the admin-only routes can be measured too
+        reader = User.objects.create_user(username="benchmark_reader", is_staff=True)
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=reader)}"
+        )
+
+        endpoints = ENDPOINTS + (S3_ENDPOINTS if direct_uploads else [])
+        results = {name: {} for name, *rest in endpoints}
+        seeded_books = 0
+        for volume in volumes:
+            seed_volume(
+                books=volume - seeded_books,
+                users=max((volume - seeded_books) // 10, 1),
+                reviews_per_book=3,
+                favorites_per_user=5,
+                records_per_user=5,
+                seed=volume,
+            )
+            seeded_books = volume
+            objects = self.prepare_reader(reader, volume)
+            # the avatar endpoints save the user, which drops its cached token;
+            # look it up again so the first endpoint isn't charged for it
+            client.get("/auth/users/me/")
+
+            self.measure_endpoints(
+                client, ENDPOINTS, objects, volume, iterations, results
+            )
+            if direct_uploads:
+                with override_settings(STORAGES=S3_STORAGES):
+                    self.measure_endpoints(
+                        client, S3_ENDPOINTS, objects, volume, iterations, results
+                    )
+        return results
+
+    def measure_endpoints(
+        self, client, endpoints, objects, volume, iterations, results
+    ):
+        for name, method, url, *rest in endpoints:
+            body = partial(rest[0], objects) if rest else None
+            options = rest[1] if len(rest) > 1 else JSON
+            results[name][volume] = self.measure(
+                client, method, url.format(**objects), body, options, iterations
+            )
+
+    def prepare_reader(self, reader, volume):
+        """
+        Give the benchmark user favorites, records and a review that grow
+        with the data volume, and return the objects to use in URLs and
+        bodies.
+        """
+        books = list(Book.objects.order_by("pk")[: max(volume // 10, 1)])
+        reader.favorite_books.add(*books)
+        book = books[0]
+        BookRecord.objects.bulk_create(
+            [
+                BookRecord(reader=reader, book=book, reading_state="rg")
+                for book in books
+            ],
+            ignore_conflicts=True,
+        )
+        review, created = BookReview.objects.get_or_create(
+            reviewed_by=reader, book=book, defaults={"body": "A benchmark review."}
+        )
+        # the book's reviews grow with the volume too, so an N+1 in the review
+        # list shows up as a growing query count
+        reviewers = User.objects.exclude(book_reviews__book=book)
+        BookReview.objects.bulk_create(
+            [
+                BookReview(
+                    book=book, reviewed_by=user, body="Another benchmark review."
+                )
+                for user in reviewers[: max(volume // 10 - book.reviews.count(), 0)]
+            ]
+        )
+        BookReview.objects.filter(book=book).update_search_vectors()
+        return {
+            "reader": reader,
+            "book": book.pk,
+            # the create and delete endpoints work on a book of their own
+            "other": Book.objects.order_by("pk").last().pk,
+            "review": review.pk,
+            "favorites": [book.pk for book in books],
+        }
+
+    def measure(self, client, method, url, body, options, iterations):
+        send = getattr(client, method)
+
+        def request_kwargs():
+            if body is None:
+                return {}
+            return {"data": body(), **options}
+
+        kwargs = request_kwargs()
+        # the query log is a bounded deque, so empty it before counting
+        reset_queries()
+        recorder = QueryShapeRecorder(settings.NPLUSONE_THRESHOLD)
+        with CaptureQueriesContext(connection) as queries:
+            with connection.execute_wrapper(recorder):
+                response = send(url, **kwargs)
+                content = response_body(response)
+        query_count = len(counted_queries(queries))
+        if response.status_code >= 400:
+            raise CommandError(
+                f"{method.upper()} {url} returned {response.status_code}"
+            )
+
+        timings = []
+        for _ in range(iterations):
+            kwargs = request_kwargs()
+            start = time.perf_counter()
+            response_body(send(url, **kwargs))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return {
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "queries": query_count,
+            "repeated": recorder.repeated(),
+            "bytes": len(content),
+        }
+
+    def report(self, results, volumes):
+        header = f"{'endpoint':<26} {'books':>8} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'bytes':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for name, by_volume in results.items():
+            for volume in volumes:
+                row = by_volume[volume]
+                self.stdout.write(
+                    f"{name:<26} {volume:>8} {row['p50']:>8.2f} {row['p95']:>8.2f} "
+                    f"{row['queries']:>8} {row['bytes']:>9}"
+                )
+
+    def check_regressions(self, results, volumes):
+        baseline = {}
+        if BASELINE_PATH.exists():
+            baseline = json.loads(BASELINE_PATH.read_text())
+
+        failures = []
+        for name, by_volume in results.items():
+            smallest = by_volume[volumes[0]]["queries"]
+            largest = by_volume[volumes[-1]]["queries"]
+            if largest > smallest:
+                failures.append(
+                    f"{name}: query count grows with data size "
+                    f"({smallest} at {volumes[0]} books, {largest} at {volumes[-1]})"
+                )
+            if name in baseline and largest > baseline[name]:
+                failures.append(
+                    f"{name}: {largest} queries, baseline is {baseline[name]}"
+                )
+            repeated = by_volume[volumes[-1]]["repeated"]
+            if repeated:
+                failures.append(f"{name}: possible N+1 queries\n{report(repeated)}")
+        return failures
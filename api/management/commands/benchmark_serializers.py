@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from api.management.commands.seed_data import seed_volume
+from api.models import Book
+from api.renderers import ORJSONRenderer, orjson
+from api.serializers import BookRowSerializer, BookSerializer
+
+
+def serialize_instances(queryset):
+    return BookSerializer(queryset, many=True).data
+
+
+def serialize_rows(queryset):
+    return BookRowSerializer(BookRowSerializer().rows(queryset), many=True).data
+
+
+# (name, serialize, renderer) combinations to compare; the first is the
+# book list's default path and the last the one FAST_BOOK_LIST switches to
+PATHS = [
+    ("BookSerializer + json", serialize_instances, JSONRenderer()),
+    ("BookSerializer + orjson", serialize_instances, ORJSONRenderer()),
+    ("BookRowSerializer + json", serialize_rows, JSONRenderer()),
+    ("BookRowSerializer + orjson", serialize_rows, ORJSONRenderer()),
+]
+
+
+# To run this management command:
+# python manage.py benchmark_serializers
+# It runs against a throwaway test database, never the configured one.
+class Command(BaseCommand):
+    help = "Compare how many books per second each list serializer and renderer handle"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            default="1000,10000",
+            help="Comma-separated numbers of books to serialize at once.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=10,
+            help="Timed runs of each path at each number of rows.",
+        )
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write(
+                "orjson isn't installed, ORJSONRenderer falls back to json."
+            )
+        sizes = sorted(int(size) for size in options["rows"].split(","))
+
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed_volume(books=sizes[-1], seed=sizes[-1])
+            results = {
+                size: self.run_paths(size, options["iterations"]) for size in sizes
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+
+    def run_paths(self, size, iterations):
+        queryset = Book.objects.order_by("title", "pk")[:size]
+        results = {}
+        expected = None
+        for name, serialize, renderer in PATHS:
+            # every path has to produce the same bytes to be a drop-in
+            body = renderer.render(serialize(queryset))
+            if expected is None:
+                expected = body
+            elif body != expected:
+                raise CommandError(f"{name} renders different JSON for {size} books")
+
+            # the query is included: skipping model instances is part of the gain
+            timings = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                renderer.render(serialize(queryset))
+                timings.append(time.perf_counter() - start)
+            results[name] = size / statistics.median(timings)
+        return results
+
+    def report(self, results):
+        header = f"{'path':<28} {'books':>8} {'books/s':>11} {'speedup':>8}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for size, by_path in results.items():
+            baseline = by_path[PATHS[0][0]]
+            for name, rate in by_path.items():
+                self.stdout.write(
+                    f"{name:<28} {size:>8} {rate:>11.0f} {rate / baseline:>7.1f}x"
+                )
@@ -0,0 +1,234 @@
+import csv
+import io
+import itertools
+import json
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import invalidate_featured_books
+from api.models import Book, BookRecord, BookReview, User
+
+
+def read_rows(path, file_format):
+    """
+    Yield one dict per row of a CSV or JSON Lines file, reading lazily so the
+    whole file is never held in memory.
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "t", "yes", "y")
+    return bool(value)
+
+
+def build_books(rows):
+    return [
+        Book(
+            title=row["title"],
+            author=row["author"],
+            publication_year=optional_int(row.get("publication_year")),
+            featured=as_bool(row.get("featured", False)),
+        )
+        for row in rows
+    ]
+
+
+def build_users(rows):
+    # passwords must already be hashed; users without one can't log in
+    # until they reset it
+    return [
+        User(
+            username=row["username"],
+            email=row.get("email") or "",
+            password=row.get("password") or make_password(None),
+        )
+        for row in rows
+    ]
+
+
+def lookup_related(rows):
+    """
+    Fetch the users and books referenced by a chunk of records or reviews
+    with one query each, keyed the way the rows refer to them.
+    """
+    users = dict(
+        User.objects.filter(username__in={row["username"] for row in rows}).values_list(
+            "username", "pk"
+        )
+    )
+    books = {
+        (title, author): pk
+        for pk, title, author in Book.objects.filter(
+            title__in={row["title"] for row in rows}
+        ).values_list("pk", "title", "author")
+    }
+    return users, books
+
+
+def build_records(rows):
+    users, books = lookup_related(rows)
+    return [
+        BookRecord(
+            reader_id=users[row["username"]],
+            book_id=books[(row["title"], row["author"])],
+            reading_state=row["reading_state"],
+        )
+        for row in rows
+        if row["username"] in users and (row["title"], row["author"]) in books
+    ]
+
+
+def build_reviews(rows):
+    users, books = lookup_related(rows)
+    return [
+        BookReview(
+            reviewed_by_id=users[row["username"]],
+            book_id=books[(row["title"], row["author"])],
+            body=row["body"],
+        )
+        for row in rows
+        if row["username"] in users and (row["title"], row["author"]) in books
+    ]
+
+
+BUILDERS = {
+    "books": (Book, build_books),
+    "users": (User, build_users),
+    "records": (BookRecord, build_records),
+    "reviews": (BookReview, build_reviews),
+}
+
+
+def copy_books(chunk):
+    """
+    Load a chunk of books with PostgreSQL COPY. COPY can't skip rows that
+    break the unique_by_author constraint, so the rows go into a temporary
+    table first and are moved over with INSERT ... ON CONFLICT DO NOTHING.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for book in build_books(chunk):
+        writer.writerow([book.title, book.author, book.publication_year, book.featured])
+    buffer.seek(0)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE book_import "
+            "(title varchar(255), author varchar(255), publication_year smallint, "
+            "featured boolean) ON COMMIT DROP"
+        )
+        copy_sql = "COPY book_import FROM STDIN WITH (FORMAT csv, NULL '')"
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(copy_sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        # Django doesn't give columns database defaults, so every NOT NULL
+        # column needs a value here
+        cursor.execute(
+            "INSERT INTO api_book "
+            "(title, author, publication_year, featured, favorite_count, "
+            "title_page_renditions, created_at, updated_at) "
+            "SELECT title, author, publication_year, featured, 0, '{}', now(), now() "
+            "FROM book_import ON CONFLICT DO NOTHING"
+        )
+
+
+# To run this management command:
+# python manage.py import_data books catalog.csv
+# python manage.py import_data reviews reviews.jsonl --batch-size 10000
+#
+# Expected columns / keys:
+#   books:   title, author, publication_year, featured
+#   users:   username, email, password (already hashed)
+#   records: username, title, author, reading_state
+#   reviews: username, title, author, body
+class Command(BaseCommand):
+    help = "Bulk import books, users, book records or reviews from CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=BUILDERS.keys())
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="File format. Defaults to the file extension.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows read and inserted at a time.",
+        )
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help="Load books with PostgreSQL COPY instead of bulk_create.",
+        )
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        path = options["path"]
+        file_format = options["format"] or (
+            "csv" if path.lower().endswith(".csv") else "jsonl"
+        )
+        if options["copy"] and (kind != "books" or connection.vendor != "postgresql"):
+            raise CommandError("--copy only works for books on PostgreSQL.")
+
+        model, build = BUILDERS[kind]
+        # with ignore_conflicts the database silently skips rows that break a
+        # unique constraint, so count the table before and after the import
+        count_before = model.objects.count()
+        rows_read = 0
+        start = time.perf_counter()
+
+        for chunk in chunked(read_rows(path, file_format), options["batch_size"]):
+            if options["copy"]:
+                copy_books(chunk)
+            else:
+                model.objects.bulk_create(build(chunk), ignore_conflicts=True)
+            rows_read += len(chunk)
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{rows_read} rows read ({rows_read / elapsed:,.0f} rows/sec)"
+            )
+
+        if kind == "reviews":
+            # bulk_create skips BookReview.save(), which fills in search_vector
+            BookReview.objects.filter(search_vector=None).update_search_vectors()
+
+        # bulk writes don't send the signals that normally invalidate this
+        invalidate_featured_books()
+
+        elapsed = time.perf_counter() - start
+        rows_inserted = model.objects.count() - count_before
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {rows_inserted} of {rows_read} {kind} in {elapsed:.1f}s "
+                f"({rows_read / max(elapsed, 1e-9):,.0f} rows/sec)."
+            )
+        )
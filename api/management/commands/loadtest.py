@@ -0,0 +1,180 @@
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+def fetch(url, headers):
+    """
+    Make one GET request and return (latency in seconds, status code).
+    """
+    request = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except OSError:
+        status = None
+    return time.perf_counter() - start, status
+
+
+def send(url, headers, concurrency, total):
+    """
+    Send `total` GET requests to `url` from `concurrency` client threads and
+    return their (latency, status) results and the wall-clock time taken.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, headers), range(total)))
+    return results, time.perf_counter() - start
+
+
+def run_load(url, headers, concurrency, total):
+    # warm up connections and caches before timing
+    send(url, headers, concurrency, concurrency)
+    results, elapsed = send(url, headers, concurrency, total)
+
+    latencies = sorted(latency * 1000 for latency, status in results)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "throughput": total / elapsed,
+        "p50": quantiles[49],
+        "p95": quantiles[94],
+        "p99": quantiles[98],
+        "errors": sum(1 for latency, status in results if status != 200),
+    }
+
+
+class ConnectionMonitor:
+    """
+    Watches the PostgreSQL database the servers use during a run: how many
+    new connections were opened (from pg_stat_database.sessions, PostgreSQL
+    14+), and the most connections open at once (sampled from
+    pg_stat_activity). Our own monitoring connection is left out.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def query(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def sessions(self):
+        # backends flush their statistics about once a second
+        time.sleep(1)
+        return self.query(
+            "SELECT sessions FROM pg_stat_database WHERE datname = current_database()"
+        )
+
+    def __enter__(self):
+        connection.ensure_connection()
+        self.sessions_before = self.sessions()
+        self.max_open = 0
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            open_connections = self.query(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            self.max_open = max(self.max_open, open_connections)
+        connection.close()
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        # less the sampling thread's own connection
+        self.opened = self.sessions() - self.sessions_before - 1
+
+
+# To run this management command, serve the app with both servers first, e.g.
+# gunicorn library.wsgi --workers 2 --threads 8 --bind 127.0.0.1:8000
+# uvicorn library.asgi:application --workers 2 --port 8001
+# then compare the sync and async versions of an endpoint:
+# python manage.py loadtest --token <token> \
+#     --target wsgi=http://127.0.0.1:8000/api/books \
+#     --target asgi=http://127.0.0.1:8001/api/async/books
+#
+# To see the effect of connection reuse, start the server with
+# DB_CONN_MAX_AGE=0, then with the defaults, then with DB_POOL=True, and run
+# python manage.py loadtest --db-stats --token <token> \
+#     --target books=http://127.0.0.1:8000/api/books
+# against the same DATABASE_URL each time.
+class Command(BaseCommand):
+    help = "Measure throughput and latency of running servers under concurrent load"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            required=True,
+            help="label=url of an endpoint to load. Can be repeated.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            default="1,10,50",
+            help="Comma-separated numbers of concurrent clients to test with.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Requests sent to each target at each concurrency.",
+        )
+        parser.add_argument("--token", help="Auth token to send with each request.")
+        parser.add_argument(
+            "--db-stats",
+            action="store_true",
+            help="Also report connections opened and open at once on the "
+            "PostgreSQL database in DATABASE_URL.",
+        )
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            label, separator, url = target.partition("=")
+            if not separator:
+                raise CommandError(f"--target must look like label=url, not {target}")
+            targets.append((label, url))
+        headers = {}
+        if options["token"]:
+            headers["Authorization"] = f"Token {options['token']}"
+
+        db_stats = options["db_stats"]
+        if db_stats and connection.vendor != "postgresql":
+            raise CommandError("--db-stats only works with PostgreSQL.")
+
+        header = f"{'target':<12} {'clients':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+        if db_stats:
+            header += f" {'new conns':>10} {'max open':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for concurrency in (int(value) for value in options["concurrency"].split(",")):
+            for label, url in targets:
+                if db_stats:
+                    with ConnectionMonitor() as monitor:
+                        row = run_load(url, headers, concurrency, options["requests"])
+                else:
+                    row = run_load(url, headers, concurrency, options["requests"])
+                line = (
+                    f"{label:<12} {concurrency:>8} {row['throughput']:>9.1f} "
+                    f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} "
+                    f"{row['errors']:>7}"
+                )
+                if db_stats:
+                    line += f" {monitor.opened:>10} {monitor.max_open:>9}"
+                self.stdout.write(line)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api.images import RENDITION_FIELDS, generate_renditions, stale_renditions
+
+
+# To run this management command:
+# python manage.py rebuild_renditions
+# e.g. after a deploy or crash, since queued renditions only live in memory
+class Command(BaseCommand):
+    help = "Build the image renditions that are missing or out of date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report images without up to date renditions without building them.",
+        )
+
+    def handle(self, *args, **options):
+        for model_label in RENDITION_FIELDS:
+            pks = stale_renditions(model_label)
+            if options["dry_run"]:
+                msg = f"{len(pks)} {model_label} image(s) need renditions."
+                self.stdout.write(self.style.WARNING(msg))
+                continue
+
+            for pk in pks:
+                generate_renditions(model_label, pk)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Built renditions for {len(pks)} {model_label} image(s)."
+                )
+            )
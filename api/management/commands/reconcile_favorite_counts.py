@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from api.cache import invalidate_featured_books
+from api.models import Book
+
+
+# To run this management command:
+# python manage.py reconcile_favorite_counts
+class Command(BaseCommand):
+    help = (
+        "Fix any drift between Book.favorite_count and the actual number of favorites"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drifted books without updating them.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = (
+            Book.objects.annotate(actual_count=Count("favorited_by"))
+            .exclude(favorite_count=F("actual_count"))
+            .values_list("pk", flat=True)
+        )
+        drifted_pks = list(drifted)
+
+        if options["dry_run"]:
+            msg = f"{len(drifted_pks)} book(s) have a drifted favorite count."
+            self.stdout.write(self.style.WARNING(msg))
+            return
+
+        updated = Book.objects.filter(pk__in=drifted_pks).refresh_favorite_counts()
+        if updated:
+            invalidate_featured_books()
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled favorite counts for {updated} book(s).")
+        )
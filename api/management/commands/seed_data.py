@@ -3,15 +3,150 @@ import random
 from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand, CommandError
 
-from api.models import Book, User, BookRecord
+from api.cache import invalidate_featured_books
+from api.models import Book, User, BookRecord, BookReview
 from library import settings
 
 
+def seed_volume(
+    books=0,
+    users=0,
+    reviews_per_book=0,
+    favorites_per_user=0,
+    records_per_user=0,
+    batch_size=1000,
+    seed=None,
+):
+    """
+    Bulk-create generated books and users, plus reviews, favorites and book
+    records linking them. Calling this again adds more rows on top of the
+    ones already there, so it can grow a database step by step.
+    """
+    rng = random.Random(seed)
+
+    first_book = Book.objects.count()
+    Book.objects.bulk_create(
+        [
+            Book(
+                title=f"Seed Book {n}",
+                author=f"Seed Author {n % 500}",
+                publication_year=rng.randint(1500, 2020),
+                featured=rng.random() < 0.01,
+            )
+            for n in range(first_book, first_book + books)
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+    # hashing is slow on purpose, so every generated user shares one hash
+    password = make_password("badpassword")
+    first_user = User.objects.count()
+    User.objects.bulk_create(
+        [
+            User(username=f"seed_user_{n}", password=password)
+            for n in range(first_user, first_user + users)
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+    book_pks = list(Book.objects.order_by("pk").values_list("pk", flat=True))
+    user_pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+    new_book_pks = book_pks[first_book:]
+    new_user_pks = user_pks[first_user:]
+
+    if reviews_per_book and user_pks:
+        BookReview.objects.bulk_create(
+            [
+                BookReview(
+                    book_id=book_pk,
+                    reviewed_by_id=user_pk,
+                    body=f"Seed review {rng.randint(0, 10**6)} of book {book_pk}.",
+                )
+                for book_pk in new_book_pks
+                for user_pk in rng.sample(
+                    user_pks, min(reviews_per_book, len(user_pks))
+                )
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        BookReview.objects.filter(search_vector=None).update_search_vectors()
+
+    if favorites_per_user and book_pks:
+        Favorite = Book.favorited_by.through
+        Favorite.objects.bulk_create(
+            [
+                Favorite(user_id=user_pk, book_id=book_pk)
+                for user_pk in new_user_pks
+                for book_pk in rng.sample(
+                    book_pks, min(favorites_per_user, len(book_pks))
+                )
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        # bulk_create skips the m2m_changed signal, so recount here
+        Book.objects.refresh_favorite_counts()
+
+    if records_per_user and book_pks:
+        BookRecord.objects.bulk_create(
+            [
+                BookRecord(
+                    reader_id=user_pk,
+                    book_id=book_pk,
+                    reading_state=rng.choice(BookRecord.ReadingState.values),
+                )
+                for user_pk in new_user_pks
+                for book_pk in rng.sample(
+                    book_pks, min(records_per_user, len(book_pks))
+                )
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    # bulk writes don't send the signals that normally invalidate this
+    invalidate_featured_books()
+
+
 # To run this management command:
 # python manage.py seed_data
+# or, to also generate a larger data set:
+# python manage.py seed_data --books 10000 --users 1000 --reviews-per-book 3
 class Command(BaseCommand):
     help = "Create some data for development"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--books", type=int, default=0, help="Number of books to generate."
+        )
+        parser.add_argument(
+            "--users", type=int, default=0, help="Number of users to generate."
+        )
+        parser.add_argument(
+            "--reviews-per-book",
+            type=int,
+            default=0,
+            help="Reviews to write for each generated book.",
+        )
+        parser.add_argument(
+            "--favorites-per-user",
+            type=int,
+            default=0,
+            help="Books each generated user favorites.",
+        )
+        parser.add_argument(
+            "--records-per-user",
+            type=int,
+            default=0,
+            help="Book records to create for each generated user.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=None, help="Random seed for repeatable data."
+        )
+
     def handle(self, *args, **options):
         if settings.DEBUG:
             books = [
@@ -57,6 +192,15 @@ class Command(BaseCommand):
                 if created:
                     book.reading_state = random.choice(["wr", "rg", "rd"])
 
+            seed_volume(
+                books=options["books"],
+                users=options["users"],
+                reviews_per_book=options["reviews_per_book"],
+                favorites_per_user=options["favorites_per_user"],
+                records_per_user=options["records_per_user"],
+                seed=options["seed"],
+            )
+
             self.stdout.write(self.style.SUCCESS("Objects added to database."))
 
         else:
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import defaultdict
+
+from .authentication import token_cache_stats
+
+
+class RequestMetrics:
+    """
+    Costs measured while handling one sampled request.
+    Attached to the request as request.metrics by RequestMetricsMiddleware.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # used with connection.execute_wrapper() to time every query
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_time += time.perf_counter() - start
+
+
+class MetricsStore:
+    """
+    Running totals of request metrics per URL name, for this process.
+    """
+
+    fields = (
+        "requests",
+        "queries",
+        "sql_seconds",
+        "serialize_seconds",
+        "seconds",
+        "bytes",
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: dict.fromkeys(self.fields, 0))
+
+    def record(self, url_name, metrics, duration, size):
+        with self.lock:
+            totals = self.totals[url_name]
+            totals["requests"] += 1
+            totals["queries"] += metrics.queries
+            totals["sql_seconds"] += metrics.sql_time
+            totals["serialize_seconds"] += metrics.serialize_time
+            totals["seconds"] += duration
+            totals["bytes"] += size
+
+    def as_prometheus(self):
+        """
+        Render the totals in the Prometheus text exposition format.
+        """
+        with self.lock:
+            totals = {name: dict(values) for name, values in self.totals.items()}
+
+        lines = []
+        for field in self.fields:
+            metric = f"library_request_{field}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for url_name, values in sorted(totals.items()):
+                lines.append(f'{metric}{{url_name="{url_name}"}} {values[field]}')
+        for outcome, count in token_cache_stats.items():
+            metric = f"library_token_cache_{outcome}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_store = MetricsStore()
+
+
+class SerializationTimingMixin:
+    """
+    Adds the time spent serializing and rendering a DRF response to the
+    request's metrics, when the request is being sampled.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = getattr(self.request, "metrics", None)
+        if metrics is not None:
+            serializer.to_representation = timed(serializer.to_representation, metrics)
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        metrics = getattr(request, "metrics", None)
+        if metrics is not None and hasattr(response, "render"):
+            response.render = timed(response.render, metrics)
+        return response
+
+
+def timed(method, metrics):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.serialize_time += time.perf_counter() - start
+
+    return wrapper
@@ -0,0 +1,225 @@
+import hashlib
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.authentication import get_authorization_header
+
+from .db_router import read_replica
+from .metrics import RequestMetrics, metrics_store
+
+
+class RequestMetricsMiddleware:
+    """
+    For a sample of requests (REQUEST_METRICS_SAMPLE_RATE, 0 turns it off),
+    count and time the SQL queries, time serialization (see
+    SerializationTimingMixin) and the whole request, and measure the response
+    size. The results go in a Server-Timing header and are added to the
+    per-URL totals served by MetricsView.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        request.metrics = metrics = RequestMetrics()
+        start = time.perf_counter()
+        with self.wrap_connections(metrics):
+            response = self.get_response(request)
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        request.metrics = metrics = RequestMetrics()
+        start = time.perf_counter()
+        # async views run their queries in this request's thread-sensitive
+        # thread, so the wrappers go on that thread's connections
+        stack = await sync_to_async(self.wrap_connections)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, metrics, time.perf_counter() - start)
+
+    def is_sampled(self):
+        sample_rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        return sample_rate and random.random() < sample_rate
+
+    def wrap_connections(self, metrics):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        return stack
+
+    def finish(self, request, response, metrics, duration):
+        size = 0 if response.streaming else len(response.content)
+        url_name = (
+            request.resolver_match.view_name if request.resolver_match else "unresolved"
+        )
+        metrics_store.record(url_name, metrics, duration, size)
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'sql;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries"',
+                f"serialize;dur={metrics.serialize_time * 1000:.1f}",
+                f"total;dur={duration * 1000:.1f}",
+            ]
+        )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets GET / HEAD / OPTIONS requests read from the read replicas (see
+    api/db_router.py), except for REPLICA_PIN_SECONDS after the same client
+    made a successful write, so that it reads its own writes even if the
+    replicas lag behind. Other methods use the primary throughout.
+
+    The pin is a cache key for the client's token, or its user if it logged
+    in with a session, so it holds whichever worker the client's next request
+    lands on. That needs a shared cache (settings.SHARED_CACHE); without one
+    every request reads from the primary.
+    """
+
+    async_capable = True
+    sync_capable = True
+    safe_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pin_key = self.pin_key(request)
+        pinned = self.may_be_pinned(request, pin_key) and cache.get(pin_key)
+        replica = self.choose_replica(request, pinned)
+        token = read_replica.set(replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_replica.reset(token)
+        if self.should_pin(request, response, pin_key):
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return self.stream_from(replica, response)
+
+    async def __acall__(self, request):
+        pin_key = await self.apin_key(request)
+        pinned = self.may_be_pinned(request, pin_key) and await cache.aget(pin_key)
+        replica = self.choose_replica(request, pinned)
+        token = read_replica.set(replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_replica.reset(token)
+        if self.should_pin(request, response, pin_key):
+            await cache.aset(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return self.stream_from(replica, response)
+
+    def pin_key(self, request):
+        """
+        The cache key that pins this client to the primary, or None if the
+        client can't be told apart from others or pins aren't used.
+        """
+        if not self.uses_pins():
+            return None
+        return self.token_pin_key(request) or self.user_pin_key(request.user)
+
+    async def apin_key(self, request):
+        # pin_key() for async requests
+        if not self.uses_pins():
+            return None
+        return self.token_pin_key(request) or self.user_pin_key(await request.auser())
+
+    def uses_pins(self):
+        return bool(settings.DATABASE_REPLICAS) and settings.SHARED_CACHE
+
+    def token_pin_key(self, request):
+        # token clients are only authenticated in the view, after the
+        # replica is chosen, so they are known by their token
+        auth = get_authorization_header(request).split()
+        if len(auth) == 2 and auth[0].lower() == b"token":
+            return f"replica_pin:token:{hashlib.sha256(auth[1]).hexdigest()}"
+        return None
+
+    def user_pin_key(self, user):
+        return f"replica_pin:user:{user.pk}" if user.is_authenticated else None
+
+    def may_be_pinned(self, request, pin_key):
+        return pin_key is not None and request.method in self.safe_methods
+
+    def choose_replica(self, request, pinned):
+        """
+        The replica all of this request's reads go to, or None to read from
+        the primary.
+        """
+        if not self.uses_pins() or request.method not in self.safe_methods or pinned:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def should_pin(self, request, response, pin_key):
+        return (
+            pin_key is not None
+            and request.method not in self.safe_methods
+            and response.status_code < 400
+        )
+
+    def stream_from(self, replica, response):
+        """
+        A streaming response runs its queries as it is sent, after this
+        middleware has returned, so read_replica is set again around each
+        chunk.
+        """
+        if replica is None or not response.streaming:
+            return response
+        if response.is_async:
+            response.streaming_content = self.aiter_with_replica(
+                replica, response.streaming_content
+            )
+        else:
+            response.streaming_content = self.iter_with_replica(
+                replica, response.streaming_content
+            )
+        return response
+
+    def iter_with_replica(self, replica, content):
+        iterator = iter(content)
+        while True:
+            token = read_replica.set(replica)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                read_replica.reset(token)
+            yield chunk
+
+    async def aiter_with_replica(self, replica, content):
+        iterator = aiter(content)
+        while True:
+            token = read_replica.set(replica)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                read_replica.reset(token)
+            yield chunk
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_favorite_counts(apps, schema_editor):
+    Book = apps.get_model("api", "Book")
+    favorites = (
+        Book.favorited_by.through.objects.filter(book=OuterRef("pk"))
+        .order_by()
+        .values("book")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Book.objects.update(favorite_count=Coalesce(Subquery(favorites), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_book_title_page_alter_book_publication_year"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="favorite_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_favorite_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_book_favorite_count"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bookreview",
+            index=models.Index(fields=["book", "id"], name="review_book_pk_idx"),
+        ),
+    ]
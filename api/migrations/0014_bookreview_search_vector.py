@@ -0,0 +1,34 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def populate_search_vectors(apps, schema_editor):
+    BookReview = apps.get_model("api", "BookReview")
+    BookReview.objects.update(
+        search_vector=django.contrib.postgres.search.SearchVector("body")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_book_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookreview",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="bookreview",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="review_search_vector_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_bookreview_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookreview",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name="bookreview",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_bookreview_timestamps"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                condition=models.Q(featured=True),
+                fields=["title"],
+                name="book_featured_idx",
+            ),
+        ),
+    ]
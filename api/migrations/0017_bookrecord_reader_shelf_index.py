@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_book_featured_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bookrecord",
+            index=models.Index(
+                fields=["reader", "reading_state", "-updated_at"],
+                name="record_reader_shelf_idx",
+            ),
+        ),
+    ]
@@ -1,5 +1,16 @@
 import datetime
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+    TrigramSimilarity,
+)
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Now, Upper
 from django.contrib.auth.models import AbstractUser
 from django.db.models.constraints import UniqueConstraint
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -7,6 +18,71 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 
 class User(AbstractUser):
     avatar = models.ImageField(upload_to="user_avatars", blank=True, null=True)
+    # names of the resized copies of avatar, built by api/images.py
+    avatar_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+
+class BookQuerySet(models.QuerySet):
+    def refresh_favorite_counts(self):
+        """
+        Recompute the stored favorite_count for every book in this queryset
+        in a single UPDATE. Returns the number of rows updated.
+        """
+        favorites = (
+            Book.favorited_by.through.objects.filter(book=OuterRef("pk"))
+            .order_by()
+            .values("book")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        # updated_at is bumped too, since it drives conditional GETs
+        return self.update(
+            favorite_count=Coalesce(Subquery(favorites), 0), updated_at=Now()
+        )
+
+    def with_review_links(self):
+        """
+        Prefetch just the review pks that BookDetailSerializer links to, so
+        serializing many books takes one reviews query instead of one per book.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                "reviews",
+                queryset=BookReview.objects.order_by("pk").only("pk", "book"),
+            )
+        )
+
+    def search(
+        self,
+        title=None,
+        author=None,
+        publication_year=None,
+        publication_year_min=None,
+        publication_year_max=None,
+    ):
+        """
+        Filter books by partial title/author and exact or ranged year, most
+        relevant first. The icontains lookups compile to
+        UPPER(column) LIKE UPPER(...), which is served by the trigram GIN
+        indexes on Book.
+        """
+        queryset = self
+        rank = Value(0.0)
+
+        if title:
+            queryset = queryset.filter(title__icontains=title)
+            rank = rank + TrigramSimilarity("title", title)
+        if author:
+            queryset = queryset.filter(author__icontains=author)
+            rank = rank + TrigramSimilarity("author", author)
+        if publication_year is not None:
+            queryset = queryset.filter(publication_year=publication_year)
+        if publication_year_min is not None:
+            queryset = queryset.filter(publication_year__gte=publication_year_min)
+        if publication_year_max is not None:
+            queryset = queryset.filter(publication_year__lte=publication_year_max)
+
+        return queryset.annotate(rank=rank).order_by("-rank", "title", "pk")
 
 
 class Book(models.Model):
@@ -25,11 +101,39 @@ class Book(models.Model):
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     favorited_by = models.ManyToManyField(User, related_name="favorite_books")
     title_page = models.ImageField(upload_to="title_pages", null=True, blank=True)
+    # names of the resized copies of title_page, built by api/images.py
+    title_page_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # denormalized count of favorited_by, kept in sync by the m2m_changed
+    # handlers in api/signals.py (see also the reconcile_favorite_counts command)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         constraints = [
             UniqueConstraint(fields=["title", "author"], name="unique_by_author")
         ]
+        indexes = [
+            # trigram indexes make title__icontains / author__icontains
+            # index scans instead of sequential scans (see BookQuerySet.search)
+            GinIndex(
+                OpClass(Upper("title"), name="gin_trgm_ops"),
+                name="book_title_trgm_idx",
+            ),
+            GinIndex(
+                OpClass(Upper("author"), name="gin_trgm_ops"),
+                name="book_author_trgm_idx",
+            ),
+            models.Index(fields=["publication_year"], name="book_pub_year_idx"),
+            # the book list's order and page cursors, see BookCursorPagination
+            models.Index(fields=["title", "id"], name="book_title_pk_idx"),
+            # only a handful of books are featured, so index just those
+            models.Index(
+                fields=["title"],
+                condition=models.Q(featured=True),
+                name="book_featured_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author}"
@@ -37,9 +141,6 @@ class Book(models.Model):
     def __repr__(self):
         return f"<Book title={self.title} pk={self.pk}>"
 
-    def favorite_count(self):
-        return self.favorited_by.count()
-
 
 class BookRecord(models.Model):
     class ReadingState(models.TextChoices):
@@ -63,6 +164,13 @@ class BookRecord(models.Model):
                 fields=["book", "reader"], name="unique_book_record_for_user"
             )
         ]
+        indexes = [
+            # a reader's shelves, most recently updated first
+            models.Index(
+                fields=["reader", "reading_state", "-updated_at"],
+                name="record_reader_shelf_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.reader.username} {self.reading_state}: {self.book.title}"
@@ -71,8 +179,35 @@ class BookRecord(models.Model):
         return f"<BookRecord pk={self.pk} reader_pk={self.reader_id} book_pk={self.book_id}>"
 
 
+class BookReviewQuerySet(models.QuerySet):
+    def update_search_vectors(self):
+        """
+        Recompute the stored search_vector for every review in this queryset.
+        Use this after writes that skip BookReview.save(), like bulk_create().
+        """
+        return self.update(search_vector=SearchVector("body"))
+
+    def search(self, search_term):
+        """
+        Full-text search on the stored search_vector, best matches first,
+        with each review's rank and a highlighted snippet of its body.
+        """
+        query = SearchQuery(search_term)
+        return (
+            self.filter(search_vector=query)
+            .annotate(
+                rank=SearchRank(F("search_vector"), query),
+                snippet=SearchHeadline("body", query),
+            )
+            .order_by("-rank", "pk")
+        )
+
+
 class BookReview(models.Model):
     body = models.TextField()
+    # to_tsvector(body), stored so full-text search can use the GIN index
+    # instead of parsing every review at query time; updated in save()
+    search_vector = SearchVectorField(null=True, editable=False)
     book = models.ForeignKey(
         to="Book", on_delete=models.CASCADE, related_name="reviews"
     )
@@ -83,15 +218,30 @@ class BookReview(models.Model):
         null=True,
         related_name="book_reviews",
     )
+    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+
+    objects = BookReviewQuerySet.as_manager()
 
     class Meta:
         constraints = [
             UniqueConstraint(fields=["reviewed_by", "book"], name="unique_user_review")
         ]
+        indexes = [
+            # supports paging through a book's reviews in pk order
+            models.Index(fields=["book", "id"], name="review_book_pk_idx"),
+            GinIndex(fields=["search_vector"], name="review_search_vector_idx"),
+        ]
 
     def __str__(self):
         return f"Review of {self.book.title}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "body" in update_fields:
+            BookReview.objects.filter(pk=self.pk).update_search_vectors()
+
     def __repr__(self):
         return (
             f"<BookReview pk={self.pk} book={self.book} reviewed_by={self.reviewed_by}>"
@@ -0,0 +1,162 @@
+import logging
+import re
+import sys
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import Serializer
+
+logger = logging.getLogger(__name__)
+
+# collapses IN (%s, %s, ...) lists so that queries differing only in the
+# number of parameters count as the same shape
+IN_LIST = re.compile(r"\((?:%s, )+%s\)")
+IGNORED_PREFIXES = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def normalize_sql(sql):
+    # Django passes the SQL with %s placeholders, so literals are already gone
+    return IN_LIST.sub("(%s)", sql)
+
+
+def find_trigger():
+    """
+    Describe what caused the current query: the serializer field being
+    rendered if there is one, otherwise the innermost frame in project code.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        serializer = frame.f_locals.get("self")
+        field = frame.f_locals.get("field")
+        if (
+            frame.f_code.co_name == "to_representation"
+            and isinstance(serializer, Serializer)
+            and field is not None
+        ):
+            return f"{type(serializer).__name__}.{field.field_name}"
+        frame = frame.f_back
+
+    base_dir = str(settings.BASE_DIR)
+    for summary in reversed(traceback.extract_stack()[:-1]):
+        if summary.filename.startswith(base_dir) and __file__ != summary.filename:
+            return f"{summary.filename}:{summary.lineno} in {summary.name}"
+    return "unknown"
+
+
+class QueryShapeRecorder:
+    """
+    An execute_wrapper that counts the queries run by shape, and remembers
+    what triggered a shape once it repeats `threshold` times.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.triggers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = normalize_sql(sql)
+        if not shape.startswith(IGNORED_PREFIXES):
+            self.counts[shape] += 1
+            if self.counts[shape] == self.threshold:
+                self.triggers[shape] = find_trigger()
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """
+        (shape, count, trigger) for every query shape run at least
+        `threshold` times, most repeated first.
+        """
+        return [
+            (shape, count, self.triggers[shape])
+            for shape, count in self.counts.most_common()
+            if count >= self.threshold
+        ]
+
+
+def report(repeated):
+    return "\n".join(
+        f"{count}x from {trigger}: {shape}" for shape, count, trigger in repeated
+    )
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None, raise_error=True, label="block"):
+    """
+    Watch every query run inside the block and flag shapes repeated at least
+    `threshold` times (default NPLUSONE_THRESHOLD), either by raising
+    NPlusOneError or by logging a warning. Usable in tests:
+
+        with detect_n_plus_one():
+            client.get("/api/books/favorites")
+    """
+    recorder = QueryShapeRecorder(threshold or settings.NPLUSONE_THRESHOLD)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+    repeated = recorder.repeated()
+    if repeated:
+        message = f"Possible N+1 queries in {label}:\n{report(repeated)}"
+        if raise_error:
+            raise NPlusOneError(message)
+        logger.warning(message)
+
+
+class NPlusOneMiddleware:
+    """
+    Runs each request under detect_n_plus_one when NPLUSONE_MODE is "warn"
+    (log a warning) or "raise" (raise NPlusOneError, e.g. in tests and CI).
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = settings.NPLUSONE_MODE
+        if mode not in ("warn", "raise"):
+            return self.get_response(request)
+
+        # queries run while a streaming response is consumed aren't inspected
+        with self.detector(request, mode):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        mode = settings.NPLUSONE_MODE
+        if mode not in ("warn", "raise"):
+            return await self.get_response(request)
+
+        # entered and exited in the request's thread-sensitive thread, where
+        # async views run their queries
+        detector = self.detector(request, mode)
+        await sync_to_async(detector.__enter__)()
+        try:
+            response = await self.get_response(request)
+        except BaseException as error:
+            if not await sync_to_async(detector.__exit__)(
+                type(error), error, error.__traceback__
+            ):
+                raise
+        else:
+            await sync_to_async(detector.__exit__)(None, None, None)
+        return response
+
+    def detector(self, request, mode):
+        label = f"{request.method} {request.path}"
+        return detect_n_plus_one(raise_error=mode == "raise", label=label)
@@ -0,0 +1,172 @@
+import json
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.fields.tuple_lookups import (
+    Tuple,
+    TupleGreaterThan,
+    TupleLessThan,
+)
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class BaseCursorPagination(CursorPagination):
+    """
+    Keyset pagination: each page is fetched with a WHERE on the ordering
+    fields instead of an OFFSET, so deep pages cost the same as the first one.
+    With several ordering fields, e.g. ("title", "pk"), the cursor holds all
+    of them and pages start after a row comparison, (title, pk) > (...), so
+    rows that share a title don't fall back to an OFFSET either.
+    Clients can ask for a smaller or larger page with ?page_size=,
+    up to settings.MAX_PAGE_SIZE.
+    """
+
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    # CursorPagination.paginate_queryset split in two around the one query it
+    # runs, so that async views can run that query with the async ORM
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Return the queryset for the requested page plus one more row, which
+        tells whether there is a following page. None if pagination is off.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = (0, False, None)
+        else:
+            offset, reverse, current_position = self.cursor
+
+        # Cursor pagination always enforces an ordering.
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # If we have a cursor with a fixed position then filter by that.
+        if current_position is not None:
+            queryset = queryset.filter(self.position_filter(current_position))
+
+        return queryset[offset : offset + self.page_size + 1]
+
+    def position_filter(self, position):
+        """
+        The lookup for the rows after `position` in the cursor's direction.
+        """
+        # Test for: (cursor reversed) XOR (queryset reversed)
+        after = self.cursor.reverse == self.ordering[0].startswith("-")
+        fields = [order.lstrip("-") for order in self.ordering]
+        if len(fields) == 1:
+            lookup = "__gt" if after else "__lt"
+            return Q(**{fields[0] + lookup: position})
+
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        lookup = TupleGreaterThan if after else TupleLessThan
+        return lookup(
+            Tuple(*(F(field) for field in fields)),
+            tuple(values),
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        if len(ordering) == 1:
+            return super()._get_position_from_instance(instance, ordering)
+        values = []
+        for order in ordering:
+            field = order.lstrip("-")
+            values.append(
+                instance[field]
+                if isinstance(instance, dict)
+                else getattr(instance, field)
+            )
+        return json.dumps(values, default=str)
+
+    def set_page(self, results):
+        """
+        Work out the page and the next / previous cursors from the rows
+        fetched with the page_queryset() queryset.
+        """
+        if self.cursor is None:
+            offset, reverse, current_position = (0, False, None)
+        else:
+            offset, reverse, current_position = self.cursor
+        self.page = list(results[: self.page_size])
+
+        # Determine the position of the final item following the page.
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            # If we have a reverse queryset, then the query ordering was in reverse
+            # so we need to reverse the items again before returning them to the user.
+            self.page = list(reversed(self.page))
+
+            # Determine next and previous positions for reverse cursors.
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            # Determine next and previous positions for forward cursors.
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        # Display page controls in the browsable API if there is more
+        # than one page.
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset])
+
+
+class BookCursorPagination(BaseCursorPagination):
+    # pk breaks ties between books with the same title; both are in the
+    # cursor, and the book_title_pk_idx index serves the row comparison
+    ordering = ("title", "pk")
+
+
+class BookReviewCursorPagination(BaseCursorPagination):
+    ordering = "pk"
+
+
+class BookRecordCursorPagination(BaseCursorPagination):
+    ordering = "pk"
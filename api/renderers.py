@@ -0,0 +1,33 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Renders the same compact JSON as DRF's JSONRenderer, several times
+    faster, using orjson. Views opt in with
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]; the book list
+    does when settings.FAST_BOOK_LIST is on.
+
+    Anything orjson can't serialize itself (Decimals, lazy translation
+    strings, ...) goes through DRF's JSON encoder. Indented output, as the
+    browsable API asks for, and setups without orjson installed fall back
+    to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default)
+        # escaped like JSONRenderer does, so the JSON is a strict JavaScript subset
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028")
+            ret = ret.replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -1,9 +1,41 @@
+import posixpath
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.text import get_valid_filename
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
+from .images import rendition_urls
+from .uploads import save_upload
 from .models import Book, BookRecord, BookReview, User
 
 
+class RenditionsField(serializers.Field):
+    """
+    Shows the URLs of the resized copies of an image field, e.g.
+    {"thumbnail": "https://...", "medium": "https://..."}.
+    Empty until the background workers have built them for the current image.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        renditions = getattr(instance, f"{self.image_field}_renditions")
+        if renditions.get("source") != getattr(instance, self.image_field).name:
+            return {}
+        storage = instance._meta.get_field(self.image_field).storage
+        urls = rendition_urls(storage, renditions)
+        request = self.context.get("request")
+        if request is not None:
+            urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+        return urls
+
+
 class UserCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -11,20 +43,99 @@ class UserCreateSerializer(serializers.ModelSerializer):
 
 
 class UserSerializer(serializers.ModelSerializer):
+    avatar_renditions = RenditionsField("avatar")
+
     class Meta:
         model = User
-        fields = ["pk", "username", "avatar"]
+        fields = ["pk", "username", "avatar", "avatar_renditions"]
 
     def update(self, instance, validated_data):
         if "file" in self.initial_data:
-            file = self.initial_data.get("file")
-            instance.avatar.save(file.name, file, save=True)
-            return instance
+            # streamed straight to storage by api/uploads.py
+            return save_upload(instance, "avatar", self.initial_data.get("file"))
         # this call to super is to make sure that update still works for other fields
         return super().update(instance, validated_data)
 
 
-class BookSerializer(serializers.ModelSerializer):
+def requested_fields(request, param, prefix):
+    # the comma-separated names in ?param= that start with prefix, without it
+    names = (name.strip() for name in request.query_params.get(param, "").split(","))
+    return [name[len(prefix) :] for name in names if name.startswith(prefix) and name]
+
+
+def sparse_fields(request, available, prefix=""):
+    """
+    The names in `available` a GET request picks with ?fields= and ?exclude=,
+    e.g. ?fields=pk,title or ?exclude=favorite_count, in their usual order.
+    Names for a nested serializer start with `prefix`, e.g. "book." for
+    ?fields=pk,book.title. Other requests, and nested serializers no
+    ?fields= name is meant for, get every field.
+    """
+    if request is None or request.method not in ("GET", "HEAD"):
+        return tuple(available)
+    picked = requested_fields(request, "fields", prefix)
+    excluded = requested_fields(request, "exclude", prefix)
+
+    errors = {}
+    for param, names in (("fields", picked), ("exclude", excluded)):
+        unknown = {name.split(".")[0] for name in names} - set(available)
+        if unknown:
+            errors[param] = [
+                f"Unknown field: {prefix}{name}" for name in sorted(unknown)
+            ]
+    if errors:
+        raise serializers.ValidationError(errors)
+    if picked:
+        picked = {name.split(".")[0] for name in picked}
+        available = [name for name in available if name in picked]
+    return tuple(name for name in available if name not in excluded)
+
+
+class SparseFieldsMixin:
+    """
+    Trims a serializer to the fields picked with ?fields= and ?exclude=,
+    see sparse_fields. Nested serializers take names prefixed with their
+    field name.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        picked = sparse_fields(self.context.get("request"), fields, self.field_prefix())
+        return {name: fields[name] for name in picked}
+
+    def field_prefix(self):
+        names = []
+        serializer = self
+        while serializer.parent is not None:
+            # the child of a ListSerializer has no field name
+            if serializer.field_name:
+                names.append(serializer.field_name)
+            serializer = serializer.parent
+        return "".join(f"{name}." for name in reversed(names))
+
+
+def only_fields(serializer, prefix=""):
+    """
+    The model fields a serializer's picked fields read, for QuerySet.only().
+    Handles model fields, slug related fields and nested serializers, which
+    is all BookSerializer and BookRecordSerializer have.
+    """
+    serializer = getattr(serializer, "child", serializer)
+    names = []
+    for field in serializer.fields.values():
+        # primary keys are always read, and only() refuses e.g. book__pk
+        if field.source == "pk":
+            continue
+        name = prefix + field.source.replace(".", "__")
+        names.append(name)
+        if isinstance(field, serializers.SlugRelatedField):
+            names.append(f"{name}__{field.slug_field}")
+        elif isinstance(field, serializers.BaseSerializer):
+            names += only_fields(field, f"{name}__")
+    return names
+
+
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = (
@@ -37,11 +148,45 @@ class BookSerializer(serializers.ModelSerializer):
         )
 
 
+class BookRowSerializer:
+    """
+    A lean, read-only stand-in for BookSerializer(many=True) on long lists.
+    It takes the rows of rows(queryset), dicts read with .values(), which
+    already are what BookSerializer would output, so no Book instances are
+    built and no serializer field runs per value. Like BookSerializer it
+    honours ?fields= and ?exclude=.
+    """
+
+    def __init__(self, instance=None, many=True, context=None):
+        self.instance = instance
+        self.context = context or {}
+        self.fields = sparse_fields(
+            self.context.get("request"), BookSerializer.Meta.fields
+        )
+
+    def rows(self, queryset, *extra):
+        # `extra` columns are read too, e.g. the ordering for page cursors,
+        # but left out of the output
+        extra = [name for name in extra if name not in self.fields]
+        return queryset.values(*self.fields, *extra)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        if rows and len(rows[0]) != len(self.fields):
+            return [{name: row[name] for name in self.fields} for row in rows]
+        return rows
+
+    @property
+    def data(self):
+        return self.to_representation(self.instance)
+
+
 class BookDetailSerializer(serializers.ModelSerializer):
     reviews = serializers.HyperlinkedRelatedField(
         many=True, read_only=True, view_name="book_review_detail"
     )
     title_page = serializers.ImageField()
+    title_page_renditions = RenditionsField("title_page")
 
     class Meta:
         model = Book
@@ -54,6 +199,7 @@ class BookDetailSerializer(serializers.ModelSerializer):
             "reviews",
             "favorite_count",
             "title_page",
+            "title_page_renditions",
         )
         validators = [
             UniqueTogetherValidator(
@@ -62,7 +208,7 @@ class BookDetailSerializer(serializers.ModelSerializer):
         ]
 
 
-class BookRecordSerializer(serializers.ModelSerializer):
+class BookRecordSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     reader = serializers.SlugRelatedField(read_only=True, slug_field="username")
 
@@ -78,3 +224,84 @@ class BookReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = BookReview
         fields = ("pk", "body", "book", "reviewed_by")
+
+
+class BookReviewSearchSerializer(BookReviewSerializer):
+    """
+    Adds the search rank and a highlighted snippet of the matching text
+    to reviews returned from a full-text search.
+    """
+
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta(BookReviewSerializer.Meta):
+        fields = BookReviewSerializer.Meta.fields + ("rank", "snippet")
+
+
+class BookSearchParamsSerializer(serializers.Serializer):
+    """
+    Validates the query params for BookSearchView.
+    """
+
+    title = serializers.CharField(required=False)
+    author = serializers.CharField(required=False)
+    publication_year = serializers.IntegerField(required=False)
+    publication_year_min = serializers.IntegerField(required=False)
+    publication_year_max = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=settings.MAX_PAGE_SIZE,
+        default=settings.PAGE_SIZE,
+    )
+
+
+class BatchFavoriteSerializer(serializers.Serializer):
+    """
+    Validates the body of a batch favorite request: lists of book pks to add
+    to and remove from the user's favorites.
+    """
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        default=list,
+        max_length=settings.MAX_BATCH_SIZE,
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        default=list,
+        max_length=settings.MAX_BATCH_SIZE,
+    )
+
+
+class BatchBookRecordSerializer(serializers.Serializer):
+    """
+    Validates one item of a batch book record request.
+    """
+
+    book = serializers.IntegerField()
+    reading_state = serializers.ChoiceField(choices=BookRecord.ReadingState.choices)
+
+
+class PresignUploadSerializer(serializers.Serializer):
+    """
+    Validates a request for a presigned direct upload of an image.
+    """
+
+    filename = serializers.CharField(max_length=100)
+    content_type = serializers.ChoiceField(
+        choices=["image/jpeg", "image/png", "image/gif", "image/webp"]
+    )
+
+    def validate_filename(self, value):
+        try:
+            return get_valid_filename(posixpath.basename(value))
+        except SuspiciousFileOperation:
+            raise serializers.ValidationError("Invalid filename.")
+
+
+class AttachUploadSerializer(serializers.Serializer):
+    upload_token = serializers.CharField()
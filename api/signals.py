@@ -0,0 +1,91 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_cached_token
+from .images import schedule_renditions
+from .cache import invalidate_featured_books, invalidate_if_featured
+from .models import Book, BookReview, User
+
+
+@receiver(m2m_changed, sender=Book.favorited_by.through)
+def update_favorite_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Book.favorite_count in sync when favorites are added or removed from
+    either side of the relation: book.favorited_by.add(user) or
+    user.favorite_books.add(book).
+    """
+    if action == "pre_clear":
+        # pk_set is None for a clear, so remember which books are about to change
+        if reverse:
+            instance._cleared_favorite_pks = list(
+                instance.favorite_books.values_list("pk", flat=True)
+            )
+        else:
+            instance._cleared_favorite_pks = [instance.pk]
+        return
+
+    if action in ("post_add", "post_remove"):
+        book_pks = pk_set if reverse else [instance.pk]
+    elif action == "post_clear":
+        book_pks = getattr(instance, "_cleared_favorite_pks", [])
+    else:
+        return
+
+    if book_pks:
+        Book.objects.filter(pk__in=book_pks).refresh_favorite_counts()
+        if not reverse:
+            instance.refresh_from_db(fields=["favorite_count"])
+        invalidate_if_featured(book_pks)
+
+
+@receiver(pre_delete, sender=User)
+def remember_favorites_of_deleted_user(sender, instance, **kwargs):
+    # deleting a user cascades to the through table without sending m2m_changed
+    instance._deleted_favorite_pks = list(
+        instance.favorite_books.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def update_favorite_counts_for_deleted_user(sender, instance, **kwargs):
+    book_pks = getattr(instance, "_deleted_favorite_pks", [])
+    if book_pks:
+        Book.objects.filter(pk__in=book_pks).refresh_favorite_counts()
+        invalidate_if_featured(book_pks)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_featured_books_for_book(sender, instance, **kwargs):
+    # any save could have changed the featured flag, so always invalidate
+    invalidate_featured_books()
+
+
+@receiver(post_save, sender=BookReview)
+@receiver(post_delete, sender=BookReview)
+def invalidate_featured_books_for_review(sender, instance, **kwargs):
+    # featured books are serialized with links to their reviews
+    invalidate_if_featured([instance.book_id])
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    # e.g. logging out, which deletes the user's token
+    invalidate_cached_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_tokens_for_user(sender, instance, created, **kwargs):
+    # cached tokens carry a copy of the user, so any change to the user
+    # (like deactivating them) has to drop it
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list("key", flat=True):
+            invalidate_cached_token(key)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=User)
+def build_image_renditions(sender, instance, **kwargs):
+    # only does anything when the image changed since the last renditions
+    schedule_renditions(instance)
@@ -0,0 +1,30 @@
+"""
+Helpers shared by api/tests.py and the benchmark command.
+"""
+
+from io import BytesIO
+
+from PIL import Image
+
+BUCKET = "direct-uploads-test"
+
+# S3 storage for a moto mock; the credentials are never sent anywhere
+S3_STORAGES = {
+    "default": {
+        "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+        "OPTIONS": {
+            "bucket_name": BUCKET,
+            "region_name": "us-east-1",
+            "access_key": "test",
+            "secret_key": "test",
+            "default_acl": None,
+        },
+    },
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def image_bytes(size=(300, 300)):
+    buffer = BytesIO()
+    Image.new("RGB", size, "teal").save(buffer, "PNG")
+    return buffer.getvalue()
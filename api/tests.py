@@ -0,0 +1,246 @@
+import base64
+import json
+from unittest import mock, skipIf
+
+import boto3
+import requests
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .management.commands.seed_data import seed_volume
+from .models import Book, BookQuerySet, BookRecord, BookReview, User
+from .nplusone import NPlusOneError, detect_n_plus_one
+from .testing import BUCKET, S3_STORAGES, image_bytes
+
+try:
+    from moto import mock_aws
+except ImportError:
+    # one of the dev packages
+    mock_aws = None
+
+
+# NPlusOneMiddleware raises on any query shape repeated NPLUSONE_THRESHOLD
+# times, so every request below also fails on an N+1. Nothing is cached
+# between requests, and the token is looked up on every one of them.
+@override_settings(NPLUSONE_MODE="raise", SHARED_CACHE=False, DATABASE_REPLICAS=[])
+class QueryCountTests(TestCase):
+    """
+    The list, detail, featured, search and batch endpoints run the same
+    number of queries however many rows they return or write.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_volume(
+            books=40,
+            users=10,
+            reviews_per_book=3,
+            favorites_per_user=5,
+            records_per_user=5,
+            seed=1,
+        )
+        cls.reader = User.objects.create_user(username="reader")
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.books = list(Book.objects.order_by("pk")[:20])
+        Book.objects.filter(pk__in=[book.pk for book in cls.books]).update(
+            featured=True
+        )
+        cls.book = cls.books[0]
+        # the book's reviews all match ?search=review
+        BookReview.objects.filter(book=cls.book).update_search_vectors()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+
+    def request(self, method, url, queries, **kwargs):
+        with self.assertNumQueries(queries):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_book_list(self):
+        for page_size in (5, 20):
+            with self.subTest(page_size=page_size):
+                response = self.request("get", f"/api/books?page_size={page_size}", 3)
+                self.assertEqual(len(response.json()["results"]), page_size)
+
+    def test_book_list_next_page(self):
+        response = self.request("get", "/api/books?page_size=5", 3)
+        self.request("get", response.json()["next"], 3)
+
+    def test_async_book_list(self):
+        for page_size in (5, 20):
+            with self.subTest(page_size=page_size):
+                response = self.request(
+                    "get", f"/api/async/books?page_size={page_size}", 3
+                )
+                self.assertEqual(len(response.json()["results"]), page_size)
+
+    def test_book_detail(self):
+        self.request("get", f"/api/books/{self.book.pk}", 4)
+
+    def test_featured_books(self):
+        response = self.request("get", "/api/books/featured", 4)
+        self.assertEqual(len(response.json()), len(self.books))
+
+    def test_book_search(self):
+        response = self.request("get", "/api/books/search/?title=seed", 2)
+        self.assertTrue(response.json())
+
+    def test_review_search(self):
+        response = self.request(
+            "get", f"/api/books/{self.book.pk}/reviews?search=review", 2
+        )
+        self.assertEqual(len(response.json()), self.book.reviews.count())
+
+    def test_batch_favorites(self):
+        for count in (5, 20):
+            with self.subTest(count=count):
+                pks = [book.pk for book in self.books[:count]]
+                self.request(
+                    "post", "/api/me/favorites", 7, data={"add": pks}, format="json"
+                )
+                self.assertEqual(self.reader.favorite_books.count(), count)
+
+    def test_batch_book_records(self):
+        for count in (5, 20):
+            with self.subTest(count=count):
+                items = [
+                    {"book": book.pk, "reading_state": "rd"}
+                    for book in self.books[:count]
+                ]
+                self.request(
+                    "post", "/api/me/book_records", 3, data=items, format="json"
+                )
+                self.assertEqual(
+                    BookRecord.objects.filter(reader=self.reader).count(), count
+                )
+
+
+class NPlusOneTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_volume(books=10, users=5, reviews_per_book=2, seed=1)
+
+    def test_raises_on_repeated_queries(self):
+        with self.assertRaisesMessage(NPlusOneError, "Possible N+1 queries"):
+            with detect_n_plus_one(threshold=5):
+                for book in Book.objects.all():
+                    list(book.reviews.all())
+
+    def test_prefetched_queries_pass(self):
+        with detect_n_plus_one(threshold=5):
+            for book in Book.objects.prefetch_related("reviews"):
+                list(book.reviews.all())
+
+    @override_settings(NPLUSONE_MODE="raise", SHARED_CACHE=False)
+    def test_middleware_raises_in_raise_mode(self):
+        # without the prefetch, each featured book queries its own reviews
+        Book.objects.update(featured=True)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="reader"))
+        with mock.patch.object(BookQuerySet, "with_review_links", BookQuerySet.all):
+            with self.assertRaises(NPlusOneError):
+                client.get("/api/books/featured")
+
+
+# renditions are built in the request, so they can be checked too
+@skipIf(mock_aws is None, "needs moto: pipenv install --dev")
+@override_settings(STORAGES=S3_STORAGES, IMAGE_WORKERS=0, MAX_UPLOAD_SIZE=100_000)
+class DirectUploadTests(TestCase):
+    """
+    The presigned direct-to-S3 upload flow, against a moto S3 mock.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username="uploads_admin", is_staff=True)
+        cls.book = Book.objects.create(title="Direct uploads", author="Test")
+        cls.other_book = Book.objects.create(title="Another book", author="Test")
+        cls.title_page = f"/api/books/{cls.book.pk}/title_page"
+
+    def setUp(self):
+        s3 = mock_aws()
+        s3.start()
+        self.addCleanup(s3.stop)
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def presign(self, url, filename="page.png"):
+        response = self.client.post(
+            f"{url}/presign",
+            {"filename": filename, "content_type": "image/png"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def upload(self, post, content):
+        # requests comes with moto, which intercepts it
+        response = requests.post(
+            post["url"], data=post["fields"], files={"file": ("page", content)}
+        )
+        self.assertLess(response.status_code, 300)
+
+    def attach(self, url, post):
+        return self.client.post(
+            f"{url}/attach", {"upload_token": post["upload_token"]}, format="json"
+        )
+
+    def test_attach_uploaded_title_page(self):
+        post = self.presign(self.title_page)
+        self.upload(post, image_bytes())
+        # renditions are scheduled for after the commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.attach(self.title_page, post)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.book.refresh_from_db()
+        self.assertTrue(self.book.title_page.name)
+        self.assertIn("thumbnail", self.book.title_page_renditions)
+
+    def test_attach_uploaded_avatar(self):
+        post = self.presign("/auth/users/me/avatar", "avatar.png")
+        self.upload(post, image_bytes())
+        response = self.attach("/auth/users/me/avatar", post)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.admin.refresh_from_db()
+        self.assertTrue(self.admin.avatar.name)
+
+    def test_refuse_attach_before_upload(self):
+        post = self.presign(self.title_page)
+        self.assertEqual(self.attach(self.title_page, post).status_code, 400)
+
+    def test_policy_limits_size(self):
+        # moto doesn't enforce POST policies, so check S3 would be told to
+        post = self.presign(self.title_page)
+        policy = json.loads(base64.b64decode(post["fields"]["policy"]))
+        self.assertIn(["content-length-range", 1, 100_000], policy["conditions"])
+
+    def test_refuse_attach_non_image(self):
+        post = self.presign(self.title_page)
+        self.upload(post, b"not an image at all")
+        self.assertEqual(self.attach(self.title_page, post).status_code, 400)
+
+    def test_refuse_token_for_another_book(self):
+        post = self.presign(self.title_page)
+        self.upload(post, image_bytes())
+        other_title_page = f"/api/books/{self.other_book.pk}/title_page"
+        self.assertEqual(self.attach(other_title_page, post).status_code, 400)
+
+    @override_settings(
+        STORAGES={
+            **S3_STORAGES,
+            "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        }
+    )
+    def test_refuse_direct_uploads_without_s3(self):
+        # with the local filesystem storage, clients have to PUT the image
+        response = self.client.post(
+            "/auth/users/me/avatar/presign",
+            {"filename": "avatar.png", "content_type": "image/png"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,284 @@
+import io
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.base import File
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, ValidationError
+from rest_framework.parsers import DataAndFiles, FileUploadParser, MultiPartParser
+
+# bytes read from the request and handed to the storage backend at a time
+CHUNK_SIZE = 64 * 1024
+
+# keeps upload tokens from being usable as any other signed value
+DIRECT_UPLOAD_SALT = "api.uploads.direct"
+
+# the first bytes of every image format Pillow is expected to handle
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF87a",
+    b"GIF89a",
+)
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = "upload_too_large"
+
+    def __init__(self):
+        super().__init__(self.message(), self.default_code)
+
+    @staticmethod
+    def message():
+        return f"Uploads can be at most {settings.MAX_UPLOAD_SIZE} bytes."
+
+
+def check_content_length(content_length):
+    # refuse before reading anything when the client announces the size
+    if content_length and int(content_length) > settings.MAX_UPLOAD_SIZE:
+        raise UploadTooLarge()
+
+
+def looks_like_image(head):
+    return head.startswith(IMAGE_SIGNATURES) or (
+        head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    )
+
+
+class LimitedStream(io.RawIOBase):
+    """
+    Reads the request body on demand, raising UploadTooLarge as soon as more
+    than MAX_UPLOAD_SIZE bytes have come through. It isn't seekable, so
+    storage backends have to consume it in order, a chunk at a time.
+    """
+
+    def __init__(self, stream, head=b""):
+        self.stream = stream
+        self.head = head
+        self.bytes_read = len(head)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        if self.head:
+            data, self.head = self.head[:size], self.head[size:]
+            return data
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > settings.MAX_UPLOAD_SIZE:
+            raise UploadTooLarge()
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class StreamedUpload(File):
+    """
+    An upload that hasn't been read yet. Saving it to a storage backend pipes
+    the request body straight through: FileSystemStorage writes each chunk
+    to MEDIA_ROOT, S3Boto3Storage sends it as a multipart upload (with
+    AWS_S3_TRANSFER_CONFIG bounding how much is buffered per part).
+    """
+
+    def __init__(self, stream, name, content_type, size=None):
+        super().__init__(stream, name)
+        self.content_type = content_type
+        if size:
+            self.size = size
+
+    def seekable(self):
+        return False
+
+    def chunks(self, chunk_size=None):
+        while data := self.file.read(chunk_size or CHUNK_SIZE):
+            yield data
+
+
+class StreamingImageUploadParser(FileUploadParser):
+    """
+    Like FileUploadParser (a raw image body named by a Content-Disposition
+    header, available as request.data["file"]) but without buffering the
+    body in memory or a temporary file first.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]
+        filename = self.get_filename(stream, media_type, parser_context)
+        if not filename:
+            raise ParseError(
+                "Missing filename. Request should include a Content-Disposition "
+                "header with a filename parameter."
+            )
+        content_length = request.META.get("CONTENT_LENGTH")
+        check_content_length(content_length)
+
+        head = stream.read(12) if stream is not None else b""
+        if not looks_like_image(head):
+            raise ParseError("Upload a JPEG, PNG, GIF or WebP image.")
+
+        upload = StreamedUpload(
+            LimitedStream(stream, head),
+            filename,
+            media_type.split(";")[0] if media_type else None,
+            int(content_length) if content_length else None,
+        )
+        return DataAndFiles({}, {"file": upload})
+
+
+class MaxUploadSizeHandler(FileUploadHandler):
+    """
+    Applies MAX_UPLOAD_SIZE to multipart form uploads, e.g. a title_page sent
+    with a book, before Django buffers them in memory or a temporary file.
+    It raises Django's own RequestDataTooBig, a 400 for plain Django views
+    like the admin; LimitedMultiPartParser turns it into UploadTooLarge.
+    """
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # refuse before reading anything when the client announces the size
+        if content_length and int(content_length) > settings.MAX_UPLOAD_SIZE:
+            raise RequestDataTooBig(UploadTooLarge.message())
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        if self.file_size > settings.MAX_UPLOAD_SIZE:
+            raise RequestDataTooBig(UploadTooLarge.message())
+        return raw_data
+
+    def file_complete(self, file_size):
+        # let the next handler build the uploaded file
+        return None
+
+
+class LimitedMultiPartParser(MultiPartParser):
+    """
+    DRF's MultiPartParser, answering uploads MaxUploadSizeHandler (or
+    Django's DATA_UPLOAD_MAX_MEMORY_SIZE) stopped with a 413 UploadTooLarge.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return super().parse(stream, media_type, parser_context)
+        except RequestDataTooBig:
+            raise UploadTooLarge()
+
+
+def save_upload(instance, field_name, upload):
+    """
+    Save an upload to an ImageField and the instance, removing whatever was
+    written if the upload turns out to be over MAX_UPLOAD_SIZE part way.
+    """
+    field = instance._meta.get_field(field_name)
+    storage = field.storage
+    name = field.generate_filename(instance, upload.name)
+    name = storage.get_available_name(name, max_length=field.max_length)
+    try:
+        name = storage.save(name, upload, max_length=field.max_length)
+    except UploadTooLarge:
+        # S3 aborts the unfinished multipart upload, but a partly written local
+        # file has to be removed
+        storage.delete(name)
+        raise
+    setattr(instance, field.attname, name)
+    instance.save()
+    return instance
+
+
+class DirectUploadsUnavailable(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Direct uploads need S3 storage. PUT the image instead."
+    default_code = "direct_uploads_unavailable"
+
+
+def s3_client(storage):
+    # only S3Boto3Storage can hand out presigned uploads
+    if not hasattr(storage, "bucket_name"):
+        raise DirectUploadsUnavailable()
+    return storage.bucket.meta.client
+
+
+def presign_upload(instance, field_name, filename, content_type):
+    """
+    Let the client upload an image for `field_name` straight to the S3
+    bucket. Returns the URL and form fields for a presigned POST, plus an
+    upload_token to pass to attach_upload once the upload has finished.
+    """
+    field = instance._meta.get_field(field_name)
+    storage = field.storage
+    client = s3_client(storage)
+
+    # a fresh directory per upload, so one can't replace another's file
+    name = field.generate_filename(instance, f"{uuid4().hex}/{filename}")
+    fields = {"Content-Type": content_type}
+    conditions = [
+        {"Content-Type": content_type},
+        ["content-length-range", 1, settings.MAX_UPLOAD_SIZE],
+    ]
+    if storage.default_acl:
+        fields["acl"] = storage.default_acl
+        conditions.append({"acl": storage.default_acl})
+
+    post = client.generate_presigned_post(
+        storage.bucket_name,
+        storage._normalize_name(name),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=settings.DIRECT_UPLOAD_EXPIRY,
+    )
+    token = signing.dumps(
+        [instance._meta.label, instance.pk, field_name, name], salt=DIRECT_UPLOAD_SALT
+    )
+    return {"url": post["url"], "fields": post["fields"], "upload_token": token}
+
+
+def attach_upload(instance, field_name, token):
+    """
+    Point `field_name` at an image uploaded with presign_upload, after
+    checking it arrived and really is an image. S3 already refused anything
+    over MAX_UPLOAD_SIZE.
+    """
+    field = instance._meta.get_field(field_name)
+    storage = field.storage
+    client = s3_client(storage)
+
+    try:
+        # the upload can finish right as its presigned POST expires
+        label, pk, signed_field, name = signing.loads(
+            token, salt=DIRECT_UPLOAD_SALT, max_age=settings.DIRECT_UPLOAD_EXPIRY * 2
+        )
+    except signing.BadSignature:
+        raise ValidationError({"upload_token": ["Invalid or expired upload token."]})
+    if (label, pk, signed_field) != (instance._meta.label, instance.pk, field_name):
+        raise ValidationError({"upload_token": ["This token is for another upload."]})
+
+    key = storage._normalize_name(name)
+    try:
+        # only the first bytes are fetched, to check what was uploaded
+        head = client.get_object(
+            Bucket=storage.bucket_name, Key=key, Range="bytes=0-11"
+        )
+    except client.exceptions.NoSuchKey:
+        raise ValidationError({"upload_token": ["The upload hasn't finished."]})
+
+    if not looks_like_image(head["Body"].read()):
+        storage.delete(name)
+        raise ValidationError({"upload_token": ["The upload isn't an image."]})
+
+    setattr(instance, field.attname, name)
+    instance.save()
+    return instance
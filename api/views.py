@@ -1,10 +1,13 @@
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.parsers import FileUploadParser, JSONParser, MultiPartParser
+from rest_framework.parsers import JSONParser
 from rest_framework.generics import (
     ListCreateAPIView,
     RetrieveDestroyAPIView,
@@ -13,53 +16,204 @@ from rest_framework.generics import (
 )
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
+from .cache import get_featured_books, invalidate_if_featured
+from .conditional import ConditionalGetMixin
+from .metrics import SerializationTimingMixin, metrics_store
+from .exports import stream_books_csv, stream_books_ndjson
 from .models import Book, BookRecord, BookReview, User
+from .renderers import ORJSONRenderer
+from .uploads import (
+    LimitedMultiPartParser,
+    StreamingImageUploadParser,
+    attach_upload,
+    presign_upload,
+    save_upload,
+)
 from .serializers import (
     BookSerializer,
     BookDetailSerializer,
+    BookRowSerializer,
     BookRecordSerializer,
     BookReviewSerializer,
+    BookReviewSearchSerializer,
+    BookSearchParamsSerializer,
+    BatchBookRecordSerializer,
+    BatchFavoriteSerializer,
+    AttachUploadSerializer,
+    PresignUploadSerializer,
     UserSerializer,
+    only_fields,
+)
+from .pagination import (
+    BookCursorPagination,
+    BookRecordCursorPagination,
+    BookReviewCursorPagination,
 )
 from .custom_permissions import (
     IsAdminOrReadOnly,
     IsReaderOrReadOnly,
 )
-from django.db.models import Count
+from django.db.models import Count, Max
+from functools import partial
+
+
+def only_picked_fields(queryset, serializer, *extra):
+    """
+    Load only the columns, and join only the tables, that the fields picked
+    with ?fields= / ?exclude= read (see api/serializers.py), plus `extra`.
+    """
+    # only() with no fields at all would load every column
+    fields = ["pk", *only_fields(serializer), *extra]
+    related = {name.split("__")[0] for name in fields if "__" in name}
+    queryset = queryset.select_related(None).only(*fields)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset
+
 
+def book_validator_values(queryset):
+    # book payloads also list their reviews, so a new or deleted review
+    # has to change the validators too
+    return queryset.annotate(
+        review_count=Count("reviews"),
+        reviews_updated_at=Max("reviews__updated_at"),
+    ).values_list("pk", "updated_at", "review_count", "reviews_updated_at")
 
-class BookViewSet(ModelViewSet):
+
+def book_validator_rows(queryset):
+    return list(book_validator_values(queryset))
+
+
+class BookViewSet(SerializationTimingMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Book.objects.all().order_by("title")
     serializer_class = BookDetailSerializer
     permission_classes = [IsAuthenticated, IsAdminOrReadOnly]
-    parser_classes = [JSONParser, MultiPartParser]
+    parser_classes = [JSONParser, LimitedMultiPartParser]
+    pagination_class = BookCursorPagination
 
     def get_serializer_class(self):
         if self.action in ["list"]:
-            return BookSerializer
+            # see settings.FAST_BOOK_LIST
+            return BookRowSerializer if settings.FAST_BOOK_LIST else BookSerializer
         return super().get_serializer_class()
 
+    def get_renderers(self):
+        # the book list is the largest payload we render, see api/renderers.py
+        if self.action == "list" and settings.FAST_BOOK_LIST:
+            return [ORJSONRenderer(), BrowsableAPIRenderer()]
+        return super().get_renderers()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.get_serializer_class() is BookDetailSerializer:
+            queryset = queryset.with_review_links()
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.get_validator_rows(queryset)
+        if not settings.FAST_BOOK_LIST:
+            return self.conditional_response(
+                request, rows, partial(super().list, request, *args, **kwargs)
+            )
+
+        def respond():
+            # plain rows of just the picked fields, see BookRowSerializer
+            rows = self.get_serializer().rows(queryset, *self.paginator.ordering)
+            serializer = self.get_serializer(self.paginate_queryset(rows), many=True)
+            return self.get_paginated_response(serializer.data)
+
+        return self.conditional_response(request, rows, respond)
+
+    def retrieve(self, request, *args, **kwargs):
+        rows = book_validator_rows(Book.objects.filter(pk=kwargs["pk"]))
+        return self.conditional_response(
+            request, rows, partial(super().retrieve, request, *args, **kwargs)
+        )
+
     @action(detail=False)
     def featured(self, request):
-        featured_books = Book.objects.filter(featured=True)
-        serializer = self.get_serializer(featured_books, many=True)
-        return Response(serializer.data)
+        featured_books = self.get_queryset().filter(featured=True)
+
+        def get_rows():
+            return book_validator_rows(
+                Book.objects.filter(featured=True).order_by("pk")
+            )
+
+        def serialize():
+            return self.get_serializer(featured_books, many=True).data
+
+        # the featured set rarely changes, so with a shared cache the rows and
+        # payload are cached until a signal in api/signals.py invalidates them
+        rows, get_data = get_featured_books(request, get_rows, serialize)
+        return self.conditional_response(request, rows, lambda: Response(get_data()))
 
     @action(detail=False)
     def favorites(self, request):
-        favorited_books = request.user.favorite_books.all()
+        favorited_books = self.get_queryset().filter(favorited_by=request.user)
         serializer = self.get_serializer(favorited_books, many=True)
         return Response(serializer.data)
 
+    @action(
+        detail=True,
+        methods=["put"],
+        url_path="title_page",
+        parser_classes=[StreamingImageUploadParser],
+    )
+    def title_page(self, request, pk=None):
+        # the raw image is piped to storage as it arrives, see api/uploads.py
+        book = save_upload(self.get_object(), "title_page", request.data["file"])
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=True, methods=["post"], url_path="title_page/presign")
+    def presign_title_page(self, request, pk=None):
+        # the client uploads the image straight to S3, then calls attach
+        params = PresignUploadSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        return Response(
+            presign_upload(self.get_object(), "title_page", **params.validated_data)
+        )
 
-class BookRecordViewSet(ModelViewSet):
-    queryset = BookRecord.objects.all()
+    @action(detail=True, methods=["post"], url_path="title_page/attach")
+    def attach_title_page(self, request, pk=None):
+        params = AttachUploadSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        book = attach_upload(
+            self.get_object(), "title_page", params.validated_data["upload_token"]
+        )
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=False)
+    def export(self, request):
+        # stream the whole catalog without building it in memory
+        # e.g. /api/books/export or /api/books/export?output=csv
+        books = Book.objects.order_by("pk")
+        if request.query_params.get("output") == "csv":
+            response = StreamingHttpResponse(
+                stream_books_csv(books), content_type="text/csv"
+            )
+            response["Content-Disposition"] = 'attachment; filename="books.csv"'
+            return response
+        return StreamingHttpResponse(
+            stream_books_ndjson(books), content_type="application/x-ndjson"
+        )
+
+
+class BookRecordViewSet(SerializationTimingMixin, ModelViewSet):
+    # BookRecordSerializer nests the book and shows the reader's username
+    queryset = BookRecord.objects.select_related("book", "reader")
     serializer_class = BookRecordSerializer
     permission_classes = [IsAuthenticated, IsReaderOrReadOnly]
+    pagination_class = BookRecordCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        return queryset.filter(reader=self.request.user, book=self.kwargs["book_pk"])
+        queryset = queryset.filter(
+            reader=self.request.user, book=self.kwargs["book_pk"]
+        )
+        if self.action in ["list", "retrieve"]:
+            queryset = only_picked_fields(queryset, self.get_serializer())
+        return queryset
 
     def create(self, request, *args, **kwargs):
         try:
@@ -75,32 +229,150 @@ class BookRecordViewSet(ModelViewSet):
         serializer.save(reader=self.request.user, book=book)
 
 
-class BookReviewListCreateView(ListCreateAPIView):
+class BatchBookRecordView(APIView):
+    """
+    Create or update many of the current user's book records in one request.
+    The body is a list like [{"book": 1, "reading_state": "rd"}, ...];
+    a book that already has a record for this user gets its state updated.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"error": "Expected a list of book records."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > settings.MAX_BATCH_SIZE:
+            return Response(
+                {"error": f"A batch can have at most {settings.MAX_BATCH_SIZE} items."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        errors = []
+        valid = {}
+        for index, item in enumerate(items):
+            serializer = BatchBookRecordSerializer(data=item)
+            if serializer.is_valid():
+                book_pk = serializer.validated_data["book"]
+                if book_pk in valid:
+                    errors.append(
+                        {
+                            "index": valid[book_pk][0],
+                            "errors": {"book": ["Duplicate book in this batch."]},
+                        }
+                    )
+                valid[book_pk] = (index, serializer.validated_data["reading_state"])
+            else:
+                errors.append({"index": index, "errors": serializer.errors})
+
+        # check every book exists with a single IN query
+        found = set(Book.objects.filter(pk__in=valid).values_list("pk", flat=True))
+        for book_pk in valid.keys() - found:
+            errors.append(
+                {"index": valid[book_pk][0], "errors": {"book": ["Book not found."]}}
+            )
+
+        # insert new records and update the state of existing ones in one statement
+        BookRecord.objects.bulk_create(
+            [
+                BookRecord(reader=request.user, book_id=book_pk, reading_state=state)
+                for book_pk, (index, state) in valid.items()
+                if book_pk in found
+            ],
+            update_conflicts=True,
+            unique_fields=["book", "reader"],
+            update_fields=["reading_state", "updated_at"],
+        )
+
+        return Response(
+            {
+                "saved": len(found),
+                "errors": sorted(errors, key=lambda error: error["index"]),
+            }
+        )
+
+
+class BookReviewListCreateView(
+    SerializationTimingMixin, ConditionalGetMixin, ListCreateAPIView
+):
     serializer_class = BookReviewSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = BookReviewCursorPagination
 
     def get_queryset(self):
-        queryset = BookReview.objects.filter(book_id=self.kwargs["book_pk"])
+        # BookReviewSerializer shows the book title and reviewer's username
+        queryset = BookReview.objects.filter(
+            book_id=self.kwargs["book_pk"]
+        ).select_related("book", "reviewed_by")
         # if query params are provided, filter the queryset
         # the url would look like this: /api/books/1/reviews/?search=foo
         search_term = self.request.query_params.get("search")
         if search_term is not None:
-            queryset = queryset.filter(
-                # Note that using this "search" lookup depends on using full-text search in Postgres
-                # https://docs.djangoproject.com/en/4.2/ref/contrib/postgres/search/#the-search-lookup
-                body__search=self.request.query_params.get("search")
-            )
+            # Note that this depends on using full-text search in Postgres
+            # https://docs.djangoproject.com/en/4.2/ref/contrib/postgres/search/
+            # search_vector is stored and GIN-indexed, so matching doesn't have
+            # to parse the body of every review
+            queryset = queryset.search(search_term)
 
         return queryset
 
+    def is_search(self):
+        return self.request.query_params.get("search") is not None
+
+    def get_serializer_class(self):
+        if self.request.method == "GET" and self.is_search():
+            return BookReviewSearchSerializer
+        return super().get_serializer_class()
+
+    def paginate_queryset(self, queryset):
+        # search results are ordered by rank, which the cursor paginator
+        # can't page through, so return the best matches up to the page size
+        if self.is_search():
+            return list(queryset[: self.paginator.get_page_size(self.request)])
+        return super().paginate_queryset(queryset)
+
+    def get_paginated_response(self, data):
+        if self.is_search():
+            return Response(data)
+        return super().get_paginated_response(data)
+
+    def list(self, request, *args, **kwargs):
+        if self.is_search():
+            # the matches are ranked and highlighted once, and the same rows
+            # give the validators and the response, like AsyncBookReviewListView
+            reviews = self.paginate_queryset(self.get_queryset())
+            rows = [(review.pk, review.updated_at) for review in reviews]
+            return self.conditional_response(
+                request,
+                rows,
+                lambda: Response(self.get_serializer(reviews, many=True).data),
+            )
+        rows = self.get_validator_rows(self.get_queryset())
+        return self.conditional_response(
+            request, rows, partial(super().list, request, *args, **kwargs)
+        )
+
     def perform_create(self, serializer, **kwargs):
         book = get_object_or_404(Book, pk=self.kwargs["book_pk"])
         serializer.save(reviewed_by=self.request.user, book=book)
 
 
-class BookReviewDetailView(RetrieveDestroyAPIView):
+class BookReviewDetailView(
+    SerializationTimingMixin, ConditionalGetMixin, RetrieveDestroyAPIView
+):
     serializer_class = BookReviewSerializer
-    queryset = BookReview.objects.all()
+    queryset = BookReview.objects.select_related("book", "reviewed_by")
+
+    def retrieve(self, request, *args, **kwargs):
+        rows = list(
+            BookReview.objects.filter(pk=kwargs["pk"]).values_list("pk", "updated_at")
+        )
+        return self.conditional_response(
+            request, rows, partial(super().retrieve, request, *args, **kwargs)
+        )
 
 
 class CreateFavoriteView(APIView):
@@ -115,46 +387,163 @@ class CreateFavoriteView(APIView):
         # I need to know the user
         user = self.request.user
         # I need to know the book
-        book = get_object_or_404(Book, pk=self.kwargs["book_pk"])
+        book = get_object_or_404(
+            Book.objects.with_review_links(), pk=self.kwargs["book_pk"]
+        )
         # I need to add the book to the user's favorites
         # This uses the related name for the relation from the user model
         user.favorite_books.add(book)
+        # the favorite count was updated in the database by a signal handler
+        book.refresh_from_db(fields=["favorite_count"])
         # use a serializer to serialize data about the book we just favorited
         serializer = BookDetailSerializer(book, context={"request": request})
         # return a response
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def delete(self, request, **kwargs):
+        book = get_object_or_404(Book, pk=self.kwargs["book_pk"])
+        # removing the relation also updates the favorite count via a signal
+        request.user.favorite_books.remove(book)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BatchFavoriteView(APIView):
+    """
+    Add and remove many favorites in one request, e.g.
+    {"add": [1, 2, 3], "remove": [4]}
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = BatchFavoriteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        to_add = set(serializer.validated_data["add"])
+        to_remove = set(serializer.validated_data["remove"]) - to_add
+
+        # check every requested book exists with a single IN query
+        found = set(
+            Book.objects.filter(pk__in=to_add | to_remove).values_list("pk", flat=True)
+        )
+        to_add &= found
+        to_remove &= found
+
+        # write straight to the through table; bulk writes skip m2m_changed,
+        # so the favorite counts are refreshed below in one UPDATE
+        Favorite = Book.favorited_by.through
+        with transaction.atomic():
+            Favorite.objects.bulk_create(
+                [Favorite(user=request.user, book_id=pk) for pk in to_add],
+                ignore_conflicts=True,
+            )
+            Favorite.objects.filter(user=request.user, book_id__in=to_remove).delete()
+            Book.objects.filter(pk__in=to_add | to_remove).refresh_favorite_counts()
+        invalidate_if_featured(to_add | to_remove)
+
+        requested = set(serializer.validated_data["add"]) | set(
+            serializer.validated_data["remove"]
+        )
+        return Response(
+            {
+                "added": sorted(to_add),
+                "removed": sorted(to_remove),
+                "not_found": sorted(requested - found),
+            }
+        )
+
+
+class ShelvesView(APIView):
+    """
+    All of the current user's book records, grouped by reading state.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        records = BookRecord.objects.filter(reader=request.user)
+        # one aggregate query for the number of records in each state
+        counts = dict.fromkeys(BookRecord.ReadingState.values, 0)
+        counts.update(
+            records.order_by().values_list("reading_state").annotate(count=Count("pk"))
+        )
+
+        shelves = {state: [] for state in BookRecord.ReadingState.values}
+        context = {"request": request}
+        records = only_picked_fields(
+            records.select_related("book", "reader"),
+            BookRecordSerializer(context=context),
+            # to shelve records even when ?fields= leaves it out
+            "reading_state",
+        ).order_by("reading_state", "-updated_at")
+        serializer = BookRecordSerializer(records, many=True, context=context)
+        for record, data in zip(records, serializer.data):
+            shelves[record.reading_state].append(data)
+
+        return Response({"counts": counts, "shelves": shelves})
+
 
 class UserAvatarView(UpdateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    parser_classes = [FileUploadParser]
+    parser_classes = [StreamingImageUploadParser]
 
     def get_object(self):
         return self.request.user
 
 
+class PresignAvatarView(APIView):
+    """
+    Hand out a presigned POST for uploading the current user's avatar
+    straight to S3. See AttachAvatarView for the second step.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        params = PresignUploadSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        return Response(presign_upload(request.user, "avatar", **params.validated_data))
+
+
+class AttachAvatarView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        params = AttachUploadSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        user = attach_upload(
+            request.user, "avatar", params.validated_data["upload_token"]
+        )
+        return Response(UserSerializer(user, context={"request": request}).data)
+
+
 class BookSearchView(APIView):
     def get(self, request, format=None):
-        # use query params to get the search term
-        # e.g /api/books/search/?title=star
+        # use query params to get the search terms
+        # e.g /api/books/search/?title=star&publication_year_min=1600&limit=10
+        params = BookSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        search_terms = dict(params.validated_data)
+        limit = search_terms.pop("limit")
 
-        title = request.query_params.get("title")
-        author = request.query_params.get("author")
-        publication_year = request.query_params.get("publication_year")
+        context = {"request": request}
+        results = only_picked_fields(
+            Book.objects.search(**search_terms), BookSerializer(context=context)
+        )[:limit]
 
-        results = Book.objects.all()
+        serializer = BookSerializer(results, many=True, context=context)
+        return Response(serializer.data)
 
-        if title:
-            results = results.filter(title__icontains=request.query_params.get("title"))
-        if author:
-            results = results.filter(
-                author__icontains=request.query_params.get("author")
-            )
-        if publication_year:
-            results = results.filter(
-                publication_year__icontains=request.query_params.get("publication_year")
-            )
 
-        serializer = BookSerializer(results, many=True)
-        return Response(serializer.data)
+class MetricsView(APIView):
+    """
+    Per-URL request metrics collected by RequestMetricsMiddleware, in the
+    Prometheus text format. Totals are per process.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        return HttpResponse(
+            metrics_store.as_prometheus(), content_type="text/plain; version=0.0.4"
+        )
@@ -22,6 +22,27 @@ env = environ.Env(
     DEBUG=(bool, False),
     RENDER=(bool, False),
     USE_S3=(bool, False),
+    PAGE_SIZE=(int, 50),
+    MAX_PAGE_SIZE=(int, 500),
+    MAX_BATCH_SIZE=(int, 1000),
+    TOKEN_AUTH_CACHE_TIMEOUT=(int, 60 * 5),
+    REQUEST_METRICS_SAMPLE_RATE=(float, 0.0),
+    NPLUSONE_MODE=(str, "off"),
+    NPLUSONE_THRESHOLD=(int, 5),
+    IMAGE_WORKERS=(int, 2),
+    IMAGE_RENDITION_FORMAT=(str, "WEBP"),
+    MAX_UPLOAD_SIZE=(int, 10 * 1024 * 1024),
+    DB_CONN_MAX_AGE=(int, 0),
+    DB_CONN_HEALTH_CHECKS=(bool, True),
+    DB_POOL=(bool, False),
+    DB_POOL_MIN_SIZE=(int, 2),
+    DB_POOL_MAX_SIZE=(int, 10),
+    DB_POOL_TIMEOUT=(float, 10.0),
+    DATABASE_REPLICA_URLS=(list, []),
+    REPLICA_PIN_SECONDS=(int, 5),
+    DIRECT_UPLOAD_EXPIRY=(int, 60 * 10),
+    FEATURED_BOOKS_CACHE_TIMEOUT=(int, 60 * 60 * 24),
+    FAST_BOOK_LIST=(bool, False),
 )
 
 env.read_env()
@@ -58,6 +79,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestMetricsMiddleware",
+    "api.nplusone.NPlusOneMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -65,10 +88,21 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # after AuthenticationMiddleware, which it needs to pin session users
+    "api.middleware.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Fraction of requests (0 to 1) that RequestMetricsMiddleware measures.
+# The totals are served at /api/metrics to admin users.
+REQUEST_METRICS_SAMPLE_RATE = env("REQUEST_METRICS_SAMPLE_RATE")
+
+# Set NPLUSONE_MODE to "warn" or "raise" to flag any query shape that runs
+# NPLUSONE_THRESHOLD or more times in one request (see api/nplusone.py)
+NPLUSONE_MODE = env("NPLUSONE_MODE")
+NPLUSONE_THRESHOLD = env("NPLUSONE_THRESHOLD")
+
 ROOT_URLCONF = "library.urls"
 
 TEMPLATES = [
@@ -92,9 +126,66 @@ WSGI_APPLICATION = "library.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+# PostgreSQL only: the search indexes need pg_trgm and full-text search, and
+# the migrations don't run on SQLite (see the README)
 
 DATABASES = {"default": env.db()}
 
+# Read replicas, as a comma-separated list of database URLs. Each GET request
+# reads from one replica, picked at random, unless the same client wrote
+# something in the last REPLICA_PIN_SECONDS; everything else uses "default".
+# The pins are kept in the cache, so without a SHARED_CACHE every request
+# reads from "default". See api/db_router.py and ReplicaRoutingMiddleware.
+for index, url in enumerate(env("DATABASE_REPLICA_URLS")):
+    DATABASES[f"replica_{index}"] = {
+        **env.db_url_config(url),
+        # tests run against the primary's test database
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["api.db_router.ReplicaRouter"]
+REPLICA_PIN_SECONDS = env("REPLICA_PIN_SECONDS")
+
+# Database connections can be reused instead of opened for every request.
+# https://docs.djangoproject.com/en/5.1/ref/databases/#connection-management
+# With DB_POOL, each process keeps a psycopg 3 pool of DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections and a request waits up to DB_POOL_TIMEOUT
+# seconds for a free one; use this under ASGI. Otherwise each thread keeps its
+# own connection for DB_CONN_MAX_AGE seconds (0, the default, closes it after
+# every request), checked before reuse when DB_CONN_HEALTH_CHECKS is on.
+# Measured with loadtest --db-stats on GET /api/books, DB_CONN_MAX_AGE=60 or
+# DB_POOL gave 45-90% more requests per second than 0, but they keep one
+# connection per thread or pool slot open, so size max_connections first.
+for database in DATABASES.values():
+    if env("DB_POOL"):
+        database.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": env("DB_POOL_MIN_SIZE"),
+            "max_size": env("DB_POOL_MAX_SIZE"),
+            "timeout": env("DB_POOL_TIMEOUT"),
+        }
+    else:
+        database["CONN_MAX_AGE"] = env("DB_CONN_MAX_AGE")
+        database["CONN_HEALTH_CHECKS"] = env("DB_CONN_HEALTH_CHECKS")
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Defaults to a per-process in-memory cache; set CACHE_URL to share one,
+# e.g. CACHE_URL=rediscache://127.0.0.1:6379/1
+
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
+# Whether every worker process sees the same cache. Cached state that has to
+# be revoked everywhere at once, like auth tokens, is only kept when it does.
+SHARED_CACHE = (
+    CACHES["default"]["BACKEND"] != "django.core.cache.backends.locmem.LocMemCache"
+)
+
+# How long a cached featured books payload is kept, in seconds. It is only
+# cached with a SHARED_CACHE, and invalidated by signals whenever it changes,
+# so this is only a backstop.
+FEATURED_BOOKS_CACHE_TIMEOUT = env("FEATURED_BOOKS_CACHE_TIMEOUT")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -141,8 +232,36 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# https://docs.djangoproject.com/en/5.2/ref/settings/#storages
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# Resized copies of uploaded images are built by a pool of IMAGE_WORKERS
+# threads per process (0 builds them during the request), in
+# IMAGE_RENDITION_FORMAT ("WEBP" or "JPEG"). See api/images.py; renditions
+# still queued when a process stops are built by `manage.py rebuild_renditions`.
+IMAGE_WORKERS = env("IMAGE_WORKERS")
+IMAGE_RENDITION_FORMAT = env("IMAGE_RENDITION_FORMAT")
+
+# Largest image upload accepted, in bytes. Raw image bodies are streamed to
+# storage without being buffered (see api/uploads.py); multipart form
+# uploads are checked by the first upload handler before Django buffers them.
+MAX_UPLOAD_SIZE = env("MAX_UPLOAD_SIZE")
+FILE_UPLOAD_HANDLERS = [
+    "api.uploads.MaxUploadSizeHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# How long a presigned direct-to-S3 upload URL stays valid, in seconds
+DIRECT_UPLOAD_EXPIRY = env("DIRECT_UPLOAD_EXPIRY")
+
 if not DEBUG:
-    STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+    STORAGES["staticfiles"] = {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"
+    }
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -155,11 +274,33 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticatedOrReadOnly"
     ],
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
-    ),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("api.authentication.CachedTokenAuthentication",),
+    # multipart uploads over MAX_UPLOAD_SIZE get a 413, see api/uploads.py
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "api.uploads.LimitedMultiPartParser",
+    ],
 }
 
+# How long an auth token and its user are cached, in seconds
+# (see api/authentication.py). Only used with a shared cache (CACHE_URL):
+# with the per-process default, a logout would only reach one worker.
+TOKEN_AUTH_CACHE_TIMEOUT = env("TOKEN_AUTH_CACHE_TIMEOUT")
+
+# Default and largest page a client can request with ?page_size=
+# (see api/pagination.py)
+PAGE_SIZE = env("PAGE_SIZE")
+MAX_PAGE_SIZE = env("MAX_PAGE_SIZE")
+
+# Largest number of items accepted by a single batch request
+MAX_BATCH_SIZE = env("MAX_BATCH_SIZE")
+
+# Serve GET /api/books and /api/async/books from plain rows rendered with
+# orjson (BookRowSerializer and ORJSONRenderer) instead of BookSerializer and
+# DRF's JSONRenderer. Same JSON; see `manage.py benchmark_serializers`.
+FAST_BOOK_LIST = env("FAST_BOOK_LIST")
+
 CORS_ALLOW_ALL_ORIGINS = True
 # allow request headers
 CORS_ALLOW_HEADERS = list(default_headers) + [
@@ -177,6 +318,8 @@ DJOSER = {
 
 # Env vars for S3
 if env("USE_S3"):
+    from boto3.s3.transfer import TransferConfig
+
     # These are necessary for AWS / make sure these are set in production as well
     AWS_ACCESS_KEY_ID = env("AWS_ACCESS_KEY_ID")
     AWS_SECRET_ACCESS_KEY = env("AWS_SECRET_ACCESS_KEY")
@@ -194,6 +337,13 @@ if env("USE_S3"):
     }
     AWS_S3_FILE_OVERWRITE = False
     AWS_QUERYSTRING_AUTH = False
+    # streamed uploads are sent as multipart uploads of 8MB parts, one part
+    # in memory at a time
+    AWS_S3_TRANSFER_CONFIG = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024,
+        multipart_chunksize=8 * 1024 * 1024,
+        use_threads=False,
+    )
 
     # This is for django-storages with boto3
-    DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+    STORAGES["default"]["BACKEND"] = "storages.backends.s3boto3.S3Boto3Storage"
@@ -13,14 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from api import views as api_views
+from api import async_views, views as api_views
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedSimpleRouter
 
-
 router = DefaultRouter(trailing_slash=False)
 router.register("books", api_views.BookViewSet, basename="books")
 books_router = NestedSimpleRouter(router, "books", lookup="book")
@@ -54,10 +54,56 @@ urlpatterns = [
         name="favorite_books",
     ),
     path("api/books/search/", api_views.BookSearchView.as_view()),
+    path("api/me/shelves", api_views.ShelvesView.as_view(), name="shelves"),
+    path(
+        "api/me/favorites",
+        api_views.BatchFavoriteView.as_view(),
+        name="batch_favorites",
+    ),
+    path(
+        "api/me/book_records",
+        api_views.BatchBookRecordView.as_view(),
+        name="batch_book_records",
+    ),
+    path("api/metrics", api_views.MetricsView.as_view(), name="metrics"),
+    # async versions of the busiest read endpoints, for running under ASGI
+    path(
+        "api/async/books", async_views.AsyncBookListView.as_view(), name="async_books"
+    ),
+    path(
+        "api/async/books/featured",
+        async_views.AsyncFeaturedBooksView.as_view(),
+        name="async_featured_books",
+    ),
+    path(
+        "api/async/books/search/",
+        async_views.AsyncBookSearchView.as_view(),
+        name="async_book_search",
+    ),
+    path(
+        "api/async/books/<int:pk>",
+        async_views.AsyncBookDetailView.as_view(),
+        name="async_book_detail",
+    ),
+    path(
+        "api/async/books/<int:book_pk>/reviews",
+        async_views.AsyncBookReviewListView.as_view(),
+        name="async_book_reviews",
+    ),
     path("admin/", admin.site.urls),
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.authtoken")),
     path(
         "auth/users/me/avatar", api_views.UserAvatarView.as_view(), name="user_avatar"
     ),
+    path(
+        "auth/users/me/avatar/presign",
+        api_views.PresignAvatarView.as_view(),
+        name="user_avatar_presign",
+    ),
+    path(
+        "auth/users/me/avatar/attach",
+        api_views.AttachAvatarView.as_view(),
+        name="user_avatar_attach",
+    ),
 ]